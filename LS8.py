@@ -7,6 +7,8 @@ import datetime
 from common_utils import raster_proc as rproc
 from common_utils import vector_operations as vop
 from osgeo import gdal, osr, ogr
+from downloader.mask_engine import MaskLUT
+from downloader.sr_reader import SRReader, SRTransform
 
 
 class SceneID:
@@ -36,6 +38,11 @@ class SceneID:
 class L2AScene:
     BANDS = ['B2','B3','B4','B5','B7']
 
+    # cloud or shadow only of high confidence
+    VALID_PIXELS_LUT = MaskLUT(lambda qa_pixels: np.where(
+        (qa_pixels == 1) | (qa_pixels & 768 == 768) | (qa_pixels & 3072 == 1), 0, 1))
+    # the same as transform_sr_values: (0.275 * raw - 2000) * 0.0001 clipped into [0, 0.9]
+    SR_TRANSFORM = SRTransform(scale=0.275 * 0.0001, offset=-0.2, clip_min=0, clip_max=0.9)
 
     @staticmethod
     def get_band_index_by_spec_name(band_spec_name):
@@ -80,12 +87,25 @@ class L2AScene:
     def calc_SR_values (band_file_full_path):
         return L2AScene.transform_sr_values(rproc.open_clipped_raster_as_image(band_file_full_path))
 
+    @staticmethod
+    def iter_SR_blocks (band_file_full_path, dtype=np.float32, window=None):
+        """
+        Yields (row offset, SR block) of band raster read by blocks,
+        dtype: np.float32 or np.int16 (SR * 10000). See SRReader.
+        """
+        return SRReader.iter_blocks(band_file_full_path, L2AScene.SR_TRANSFORM, dtype, window)
+
+    @staticmethod
+    def read_SR_values (band_file_full_path, dtype=np.float32, window=None):
+        """Same as calc_SR_values for whole raster or window, float32 (or int16) array is filled by blocks."""
+        return SRReader.read(band_file_full_path, L2AScene.SR_TRANSFORM, dtype, window)
+
     @staticmethod
     def calc_valid_pixels_mask (cloud_qa_pixels, qa_pixels):
         valid_pixels = np.empty( (cloud_qa_pixels.shape[0], cloud_qa_pixels.shape[1], 1), dtype=np.uint8 )
 
         # cloud or shadow only of high confidence
-        valid_pixels[:,:,0] = np.where( (qa_pixels == 1) | (qa_pixels & 768 == 768) | (qa_pixels & 3072 == 1) , 0, 1)
+        valid_pixels[:,:,0] = L2AScene.VALID_PIXELS_LUT.apply(qa_pixels)
 
         # cloud or shadow of any confidence
         """
@@ -96,3 +116,8 @@ class L2AScene:
                                )
         """
         return valid_pixels
+
+    @staticmethod
+    def calc_valid_pixels_mask_from_file (pixel_quality_file_full_path):
+        """Same as calc_valid_pixels_mask, QA_PIXEL raster is read by blocks. Returns 2D uint8 array."""
+        return L2AScene.VALID_PIXELS_LUT.calc_raster_mask(pixel_quality_file_full_path)
@@ -7,7 +7,9 @@ import datetime
 from common_utils import raster_proc as rproc
 from common_utils import vector_operations as vop
 from osgeo import gdal, osr, ogr
-import json
+from downloader.scene_layout import SceneLayout
+from downloader.mask_engine import MaskLUT
+from downloader.sr_reader import SRReader, SRTransform
 
 
 class SceneID:
@@ -36,6 +38,10 @@ class SceneID:
 class L2AScene:
     #BANDS = ['B02','B03','B04','B05','B06','B07','B08', 'B11', 'B12','SCL']
     BANDS = ['B02', 'B03', 'B04', 'B08', 'B12']
+    # SCL classes: 2 - dark area, 4 - vegetation, 5 - bare soil, 6 - water, 7 - unclassified
+    VALID_PIXELS_LUT = MaskLUT.from_classes([2, 4, 5, 6, 7])
+    # the same as transform_sr_values
+    SR_TRANSFORM = SRTransform(scale=0.0001)
 
     @staticmethod
     def get_band_index_by_spec_name(band_spec_name):
@@ -49,15 +55,8 @@ class L2AScene:
 
     @staticmethod
     def get_proper_tile_version (scene_full_path):
-        sceneid = L2AScene.get_scene_id_from_path(scene_full_path)
-        if not os.path.exists(os.path.join(scene_full_path,'1')):
-            return 0
-        else:
-            # Opening JSON file
-            f = open(os.path.join(scene_full_path,'0/productInfo.json'))
-            data = json.load(f)
-            f.close()
-            return 0 if data['name']==sceneid else 1
+        # folder is scanned and productInfo.json is parsed only once while scene folder is unchanged
+        return SceneLayout.get(scene_full_path)['tile_version']
 
 
 
@@ -84,11 +83,28 @@ class L2AScene:
     def calc_SR_values (band_file_full_path):
         return L2AScene.transform_sr_values(rproc.open_clipped_raster_as_image(band_file_full_path))
 
+    @staticmethod
+    def iter_SR_blocks (band_file_full_path, dtype=np.float32, window=None):
+        """
+        Yields (row offset, SR block) of band raster read by blocks,
+        dtype: np.float32 or np.int16 (SR * 10000). See SRReader.
+        """
+        return SRReader.iter_blocks(band_file_full_path, L2AScene.SR_TRANSFORM, dtype, window)
+
+    @staticmethod
+    def read_SR_values (band_file_full_path, dtype=np.float32, window=None):
+        """Same as calc_SR_values for whole raster or window, float32 (or int16) array is filled by blocks."""
+        return SRReader.read(band_file_full_path, L2AScene.SR_TRANSFORM, dtype, window)
+
     @staticmethod
     def calc_valid_pixels_mask (cloud_qa_pixels, qa_pixels):
         valid_pixels = np.empty( (cloud_qa_pixels.shape[0], cloud_qa_pixels.shape[1], 1), dtype=np.uint8 )
 
-        valid_pixels[:,:,0] = np.where(
-            (qa_pixels == 2) | (qa_pixels == 4) | (qa_pixels == 5) | (qa_pixels == 6) | (qa_pixels == 7),1,0)
+        valid_pixels[:,:,0] = L2AScene.VALID_PIXELS_LUT.apply(qa_pixels)
 
         return valid_pixels
+
+    @staticmethod
+    def calc_valid_pixels_mask_from_file (pixel_quality_file_full_path):
+        """Same as calc_valid_pixels_mask, SCL raster is read by blocks. Returns 2D uint8 array."""
+        return L2AScene.VALID_PIXELS_LUT.calc_raster_mask(pixel_quality_file_full_path)
@@ -0,0 +1,108 @@
+import sqlite3
+import datetime
+import threading
+
+
+class MetadataCatalog:
+    """
+    Local (sqlite) catalog of scene metadata records. Besides scenes it stores which date windows
+    were already requested from remote service for every AOI (tile or vector file) and query type
+    (platform/product and max cloud cover), so repeated queries request only uncovered date ranges.
+    Scene rows are tuples (platform, sceneid, productid, acqdate, tileid, cloudcover),
+    acqdate is datetime.
+    """
+    DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.__conn.executescript('''
+            CREATE TABLE IF NOT EXISTS scenes (
+                sceneid TEXT PRIMARY KEY, platform TEXT, productid TEXT,
+                acqdate TEXT, tileid TEXT, cloudcover REAL);
+            CREATE INDEX IF NOT EXISTS scenes_tileid ON scenes (tileid);
+            CREATE INDEX IF NOT EXISTS scenes_acqdate ON scenes (acqdate);
+            CREATE INDEX IF NOT EXISTS scenes_platform ON scenes (platform);
+            CREATE INDEX IF NOT EXISTS scenes_cloudcover ON scenes (cloudcover);
+            CREATE TABLE IF NOT EXISTS aoi_scenes (
+                aoi TEXT, query TEXT, sceneid TEXT, PRIMARY KEY (aoi, query, sceneid));
+            CREATE TABLE IF NOT EXISTS windows (
+                aoi TEXT, query TEXT, cloud_max REAL, startdate TEXT, enddate TEXT);
+            CREATE INDEX IF NOT EXISTS windows_aoi ON windows (aoi, query);
+        ''')
+        self.__conn.commit()
+
+    @staticmethod
+    def __cloud_max(cloud_max):
+        return 100.0 if cloud_max is None else float(cloud_max)
+
+    def add_scenes(self, aoi, query, rows):
+        """Inserts (or updates) scene rows and links them to aoi and query."""
+        with self.__lock:
+            self.__conn.executemany('INSERT OR REPLACE INTO scenes '
+                                    '(platform, sceneid, productid, acqdate, tileid, cloudcover) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)',
+                                    [(r[0], r[1], r[2], r[3].strftime(MetadataCatalog.DATETIME_FORMAT), r[4], r[5])
+                                     for r in rows])
+            self.__conn.executemany('INSERT OR IGNORE INTO aoi_scenes (aoi, query, sceneid) VALUES (?, ?, ?)',
+                                    [(aoi, query, r[1]) for r in rows])
+            self.__conn.commit()
+
+    def add_window(self, aoi, query, cloud_max, startdate, enddate):
+        """Records that date window (datetime.date, inclusive) was requested from remote service."""
+        with self.__lock:
+            self.__conn.execute('INSERT INTO windows (aoi, query, cloud_max, startdate, enddate) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (aoi, query, MetadataCatalog.__cloud_max(cloud_max),
+                                 startdate.isoformat(), enddate.isoformat()))
+            self.__conn.commit()
+
+    def gaps(self, aoi, query, cloud_max, startdate, enddate):
+        """
+        Returns list of (startdate, enddate) date windows (inclusive) not covered by windows
+        already requested for aoi and query with the same or bigger cloud_max.
+        """
+        with self.__lock:
+            windows = self.__conn.execute('SELECT startdate, enddate FROM windows '
+                                          'WHERE aoi = ? AND query = ? AND cloud_max >= ? '
+                                          'AND enddate >= ? AND startdate <= ? ORDER BY startdate',
+                                          (aoi, query, MetadataCatalog.__cloud_max(cloud_max),
+                                           startdate.isoformat(), enddate.isoformat())).fetchall()
+        gaps = list()
+        current = startdate
+        for w_start, w_end in windows:
+            w_start = datetime.date.fromisoformat(w_start)
+            w_end = datetime.date.fromisoformat(w_end)
+            if w_start > current:
+                gaps.append((current, min(w_start - datetime.timedelta(days=1), enddate)))
+            current = max(current, w_end + datetime.timedelta(days=1))
+            if current > enddate: break
+        if current <= enddate:
+            gaps.append((current, enddate))
+        return gaps
+
+    def query(self, aoi, query, startdate, enddate, cloud_max=None, platform=None, tiles=None):
+        """Returns scene rows linked to aoi and query acquired between startdate and enddate (inclusive)."""
+        sql = ('SELECT s.platform, s.sceneid, s.productid, s.acqdate, s.tileid, s.cloudcover '
+               'FROM scenes s JOIN aoi_scenes a ON s.sceneid = a.sceneid '
+               'WHERE a.aoi = ? AND a.query = ? AND s.acqdate >= ? AND s.acqdate < ?')
+        params = [aoi, query, startdate.isoformat(), (enddate + datetime.timedelta(days=1)).isoformat()]
+        if cloud_max is not None:
+            sql += ' AND (s.cloudcover IS NULL OR s.cloudcover <= ?)'
+            params.append(cloud_max)
+        if platform is not None:
+            sql += ' AND s.platform = ?'
+            params.append(platform)
+        if tiles is not None:
+            sql += f' AND s.tileid IN ({",".join("?" * len(tiles))})'
+            params += list(tiles)
+        sql += ' ORDER BY s.acqdate, s.sceneid'
+        with self.__lock:
+            rows = self.__conn.execute(sql, params).fetchall()
+        return [(r[0], r[1], r[2], datetime.datetime.strptime(r[3], MetadataCatalog.DATETIME_FORMAT), r[4], r[5])
+                for r in rows]
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
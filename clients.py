@@ -0,0 +1,53 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+
+class ClientManager:
+    """
+    Factory of boto3 s3 clients with configurable connection pool, retries and timeouts.
+
+    Clients are created lazily. By default one client is created per process and shared
+    by all its threads (boto3 clients are thread safe), with per_thread=True every thread
+    gets its own client. Process id is checked on every call, so worker processes
+    forked after init don't reuse parent's client and connections.
+    max_pool_connections should be not less than number of threads using one client,
+    otherwise urllib3 discards connections ("connection pool is full").
+    """
+
+    def __init__(self, max_pool_connections=10, max_attempts=5, retry_mode='standard',
+                 connect_timeout=10, read_timeout=60, per_thread=False, **client_kwargs):
+        """
+        Args:
+            client_kwargs: passed to boto3 client (aws_access_key_id, endpoint_url, region_name ...)
+        """
+        self.config = Config(max_pool_connections=max_pool_connections,
+                             retries={'max_attempts': max_attempts, 'mode': retry_mode},
+                             connect_timeout=connect_timeout,
+                             read_timeout=read_timeout)
+        self.per_thread = per_thread
+        self.client_kwargs = client_kwargs
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__client = None
+        self.__pid = None
+
+    def __create_client(self):
+        # boto3 sessions aren't thread safe, so every client is created by its own session
+        return boto3.session.Session().client('s3', config=self.config, **self.client_kwargs)
+
+    def get(self):
+        """Returns client of current process (or thread if per_thread is set)."""
+        pid = os.getpid()
+        if self.per_thread:
+            if getattr(self.__local, 'pid', None) != pid:
+                self.__local.client = self.__create_client()
+                self.__local.pid = pid
+            return self.__local.client
+
+        with self.__lock:
+            if self.__pid != pid:
+                self.__client = self.__create_client()
+                self.__pid = pid
+            return self.__client
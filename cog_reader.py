@@ -0,0 +1,239 @@
+import zlib
+import struct
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+
+class COGReader:
+    """
+    Reads windows of Cloud Optimized GeoTIFF (e.g. AWS_COG.get_10m_bands_urls) by HTTP range requests.
+    Header and tile index (offsets and byte counts of internal tiles) are read once on open,
+    then only tiles intersecting requested window are fetched, adjacent byte ranges
+    are merged into one request.
+    Supports tiled TIFF/BigTIFF, uncompressed or deflate compressed, with or without
+    horizontal predictor - the layout of Sentinel 2 COGs.
+    """
+    # size of the first request, COG header and tile index are usually inside it
+    header_size = 64 * 1024
+    # byte ranges separated by gap not bigger than merge_gap are requested at once
+    merge_gap = 32 * 1024
+    max_workers = 4
+    # (connect, read) timeouts of HTTP requests in seconds
+    timeout = (10, 60)
+
+    TYPE_FORMATS = {1: 'B', 2: 'B', 3: 'H', 4: 'I', 5: 'II', 6: 'b', 7: 'B', 8: 'h',
+                    9: 'i', 10: 'ii', 11: 'f', 12: 'd', 16: 'Q', 17: 'q', 18: 'Q'}
+    SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+
+    def __init__(self, url, level=0, session=None):
+        """
+        Args:
+            level: image index, 0 - full resolution, 1... - overviews
+            session: requests.Session to reuse connections between readers
+        """
+        self.url = url
+        self.session = session if session is not None else requests.Session()
+        self.__header = self.__get_range(0, COGReader.header_size - 1)
+        self.__parse_header(level)
+
+    def __get_range(self, start, end):
+        r = self.session.get(self.url, headers={'Range': f'bytes={start}-{end}'}, timeout=COGReader.timeout)
+        if r.status_code == 206:
+            return r.content
+        elif r.status_code == 200:
+            # server ignores Range header
+            return r.content[start:end + 1]
+        else:
+            raise Exception(f'ERROR: {r.status_code} {self.url}')
+
+    def __read(self, offset, size):
+        if offset + size <= len(self.__header):
+            return self.__header[offset:offset + size]
+        return self.__get_range(offset, offset + size - 1)
+
+    def __unpack(self, fmt, data):
+        return struct.unpack(self.__byte_order + fmt, data)
+
+    def __read_ifd(self, ifd_offset):
+        if self.__bigtiff:
+            entries_num = self.__unpack('Q', self.__read(ifd_offset, 8))[0]
+            entry_size, count_fmt, value_size = 20, 'Q', 8
+            ifd_offset += 8
+        else:
+            entries_num = self.__unpack('H', self.__read(ifd_offset, 2))[0]
+            entry_size, count_fmt, value_size = 12, 'I', 4
+            ifd_offset += 2
+
+        ifd_data = self.__read(ifd_offset, entries_num * entry_size + value_size)
+        tags = dict()
+        for i in range(entries_num):
+            entry = ifd_data[i * entry_size:(i + 1) * entry_size]
+            tag, tag_type = self.__unpack('HH', entry[0:4])
+            count = self.__unpack(count_fmt, entry[4:4 + value_size])[0]
+            if tag_type not in COGReader.TYPE_FORMATS: continue
+            fmt = COGReader.TYPE_FORMATS[tag_type]
+            size = struct.calcsize('<' + fmt) * count
+            value_field = entry[entry_size - value_size:]
+            if size <= value_size:
+                data = value_field[:size]
+            else:
+                data = self.__read(self.__unpack('Q' if self.__bigtiff else 'I', value_field)[0], size)
+            values = self.__unpack(fmt * count, data)
+            tags[tag] = data.rstrip(b'\x00').decode() if tag_type == 2 else values
+        next_ifd = self.__unpack('Q' if self.__bigtiff else 'I',
+                                 ifd_data[entries_num * entry_size:entries_num * entry_size + value_size])[0]
+        return tags, next_ifd
+
+    def __parse_header(self, level):
+        self.__byte_order = '<' if self.__header[0:2] == b'II' else '>'
+        version = self.__unpack('H', self.__header[2:4])[0]
+        if version == 43:
+            self.__bigtiff = True
+            ifd_offset = self.__unpack('Q', self.__header[8:16])[0]
+        elif version == 42:
+            self.__bigtiff = False
+            ifd_offset = self.__unpack('I', self.__header[4:8])[0]
+        else:
+            raise Exception(f'ERROR: not a TIFF file {self.url}')
+
+        geo_tags = None
+        for i in range(level + 1):
+            if ifd_offset == 0:
+                raise Exception(f'ERROR: image level {level} not found {self.url}')
+            tags, ifd_offset = self.__read_ifd(ifd_offset)
+            # georeference is stored in the first image only
+            if geo_tags is None: geo_tags = tags
+
+        if 322 not in tags:
+            raise Exception(f'ERROR: TIFF isn\'t tiled {self.url}')
+        if tags.get(284, (1,))[0] != 1:
+            raise Exception(f'ERROR: planar configuration isn\'t supported {self.url}')
+
+        self.width = tags[256][0]
+        self.height = tags[257][0]
+        self.tile_width = tags[322][0]
+        self.tile_height = tags[323][0]
+        self.tile_offsets = tags[324]
+        self.tile_byte_counts = tags[325]
+        self.samples = tags.get(277, (1,))[0]
+        self.compression = tags.get(259, (1,))[0]
+        self.predictor = tags.get(317, (1,))[0]
+        self.dtype = np.dtype(self.__byte_order + COGReader.SAMPLE_FORMATS[tags.get(339, (1,))[0]]
+                              + str(tags.get(258, (8,))[0] // 8))
+        self.nodata = float(tags[42113]) if 42113 in tags else None
+        self.tiles_across = (self.width + self.tile_width - 1) // self.tile_width
+        self.tiles_down = (self.height + self.tile_height - 1) // self.tile_height
+
+        if self.compression not in (1, 8, 32946):
+            raise Exception(f'ERROR: compression {self.compression} isn\'t supported {self.url}')
+        if self.predictor not in (1, 2):
+            raise Exception(f'ERROR: predictor {self.predictor} isn\'t supported {self.url}')
+
+        # geotransform (GDAL order) from ModelPixelScale and ModelTiepoint tags
+        self.geotransform = None
+        if 33550 in geo_tags and 33922 in geo_tags:
+            scale = geo_tags[33550]
+            tiepoint = geo_tags[33922]
+            level_scale = geo_tags[256][0] / self.width
+            self.geotransform = (tiepoint[3] - tiepoint[0] * scale[0], scale[0] * level_scale, 0,
+                                 tiepoint[4] + tiepoint[1] * scale[1], 0, -scale[1] * level_scale)
+        # EPSG code from GeoKeyDirectory: ProjectedCSTypeGeoKey or GeographicTypeGeoKey
+        self.epsg = None
+        if 34735 in geo_tags:
+            keys = geo_tags[34735]
+            for i in range(4, len(keys), 4):
+                if keys[i] in (3072, 2048) and keys[i + 1] == 0:
+                    self.epsg = keys[i + 3]
+                    if keys[i] == 3072: break
+
+    def window_from_bbox(self, minx, miny, maxx, maxy):
+        """
+        Converts bbox in raster CRS (see epsg) into pixel window (col_off, row_off, width, height)
+        clipped by raster extent. Returns None if bbox doesn't intersect raster.
+        """
+        gt = self.geotransform
+        col_min = max(int(np.floor((minx - gt[0]) / gt[1])), 0)
+        col_max = min(int(np.ceil((maxx - gt[0]) / gt[1])), self.width)
+        row_min = max(int(np.floor((maxy - gt[3]) / gt[5])), 0)
+        row_max = min(int(np.ceil((miny - gt[3]) / gt[5])), self.height)
+        if col_min >= col_max or row_min >= row_max: return None
+        return col_min, row_min, col_max - col_min, row_max - row_min
+
+    def tiles_for_window(self, col_off, row_off, width, height):
+        """Returns list of (tile_row, tile_col) of internal tiles intersecting pixel window."""
+        return [(r, c)
+                for r in range(row_off // self.tile_height, (row_off + height - 1) // self.tile_height + 1)
+                for c in range(col_off // self.tile_width, (col_off + width - 1) // self.tile_width + 1)]
+
+    def byte_ranges(self, tiles):
+        """
+        Groups tiles into merged byte ranges.
+
+        Returns:
+            list of (start, end, [(tile_row, tile_col, offset, byte_count) ...]), end is inclusive
+        """
+        parts = sorted((self.tile_offsets[r * self.tiles_across + c], self.tile_byte_counts[r * self.tiles_across + c],
+                        r, c) for r, c in tiles)
+        ranges = list()
+        for offset, byte_count, r, c in parts:
+            if byte_count == 0: continue
+            if len(ranges) > 0 and offset <= ranges[-1][1] + 1 + COGReader.merge_gap:
+                ranges[-1][1] = max(ranges[-1][1], offset + byte_count - 1)
+                ranges[-1][2].append((r, c, offset, byte_count))
+            else:
+                ranges.append([offset, offset + byte_count - 1, [(r, c, offset, byte_count)]])
+        return [tuple(rng) for rng in ranges]
+
+    def __decode_tile(self, data):
+        if self.compression != 1:
+            data = zlib.decompress(data)
+        tile = np.frombuffer(data, dtype=self.dtype,
+                             count=self.tile_width * self.tile_height * self.samples)
+        tile = tile.reshape(self.tile_height, self.tile_width, self.samples)
+        if self.predictor == 2:
+            tile = np.cumsum(tile, axis=1, dtype=self.dtype)
+        return tile
+
+    def read_window(self, col_off, row_off, width, height):
+        """
+        Reads pixel window fetching only intersecting tiles.
+        Returns array (height, width) or (height, width, samples), missing tiles are filled with nodata.
+        Window must be inside raster (see window_from_bbox to clip bbox by raster extent).
+        """
+        if width <= 0 or height <= 0 or col_off < 0 or row_off < 0 \
+                or col_off + width > self.width or row_off + height > self.height:
+            raise Exception(f'ERROR: window {(col_off, row_off, width, height)} is out of raster '
+                            f'{self.width}x{self.height} {self.url}')
+        out = np.full((height, width, self.samples),
+                      self.nodata if self.nodata is not None else 0, dtype=self.dtype.newbyteorder('='))
+
+        def fetch(rng):
+            data = self.__get_range(rng[0], rng[1])
+            for r, c, offset, byte_count in rng[2]:
+                tile = self.__decode_tile(data[offset - rng[0]:offset - rng[0] + byte_count])
+                # intersection of the tile and the window in raster coordinates
+                x0, y0 = max(c * self.tile_width, col_off), max(r * self.tile_height, row_off)
+                x1 = min((c + 1) * self.tile_width, col_off + width)
+                y1 = min((r + 1) * self.tile_height, row_off + height)
+                out[y0 - row_off:y1 - row_off, x0 - col_off:x1 - col_off] = \
+                    tile[y0 - r * self.tile_height:y1 - r * self.tile_height,
+                         x0 - c * self.tile_width:x1 - c * self.tile_width]
+
+        ranges = self.byte_ranges(self.tiles_for_window(col_off, row_off, width, height))
+        with ThreadPoolExecutor(max_workers=COGReader.max_workers) as executor:
+            for future in [executor.submit(fetch, rng) for rng in ranges]:
+                future.result()
+
+        return out[:, :, 0] if self.samples == 1 else out
+
+    def read_bbox(self, minx, miny, maxx, maxy):
+        """
+        Reads window covering bbox in raster CRS.
+        Returns (array, geotransform of window) or (None, None) if bbox doesn't intersect raster.
+        """
+        window = self.window_from_bbox(minx, miny, maxx, maxy)
+        if window is None: return None, None
+        gt = self.geotransform
+        return (self.read_window(*window),
+                (gt[0] + window[0] * gt[1], gt[1], 0, gt[3] + window[1] * gt[5], 0, gt[5]))
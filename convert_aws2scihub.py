@@ -0,0 +1,32 @@
+import sys
+import json
+import argparse
+from downloader.scene_converter import AWS2SciHubConverter
+
+parser = argparse.ArgumentParser(description = ('Converts S2 L2A scene folders downloaded from AWS bucket '
+                                                'sentinel-s2-l2a into Sci-HUB format. '
+                                                'Prints json line with result per scene'))
+
+parser.add_argument('-i', required=True, metavar='input folder', help='Folder with L2A scene folders')
+parser.add_argument('-o', required=False, metavar='output folder',
+                    help='Output folder, required for hardlink and symlink modes')
+parser.add_argument('-mode', default='move', choices=AWS2SciHubConverter.MODES,
+                    help='move - convert scene folders in place (default), '
+                         'hardlink/symlink - build Sci-HUB layout in output folder by links to input files')
+parser.add_argument('-w', type=int, default=8, metavar='workers',
+                    help='Number of scenes converted in parallel, default 8')
+parser.add_argument('-p', action='store_true', help='Use processes instead of threads')
+
+
+if (len(sys.argv)==1):
+    parser.print_usage()
+    exit(0)
+
+args = parser.parse_args()
+
+if args.mode != 'move' and args.o is None:
+    print('ERROR: output folder (-o) is required for ' + args.mode + ' mode')
+    exit(1)
+
+for result in AWS2SciHubConverter.convert_all(args.i, args.mode, args.o, args.w, args.p):
+    print(json.dumps(result), flush=True)
@@ -1,40 +1,70 @@
-from downloader import s2_meta
+import os
+import csv
+import datetime
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from downloader.s3_common import S3
-import boto3
+from downloader.listing_cache import ListingCache
+from downloader.clients import ClientManager
+from downloader.scene_ids import S2SceneIDs
 
 
 class AWS_L2A:
     s3_client = None
+    clients = None
     l2a_bucket = 'sentinel-s2-l2a'
 
     @staticmethod
-    def init(aws_access_key_id, aws_secret_access_key) :
-        AWS_L2A.s3_client = boto3.client('s3',
-                                       aws_access_key_id=aws_access_key_id,
-                                       aws_secret_access_key=aws_secret_access_key)
+    def init(aws_access_key_id=None, aws_secret_access_key=None, **client_options) :
+        """
+        If keys aren't passed boto3 default credentials chain is used.
+        client_options (max_pool_connections, max_attempts, timeouts, per_thread) are passed to ClientManager.
+        """
+        AWS_L2A.clients = ClientManager(aws_access_key_id=aws_access_key_id,
+                                        aws_secret_access_key=aws_secret_access_key,
+                                        **client_options)
+        AWS_L2A.s3_client = AWS_L2A.clients.get()
+
+    @staticmethod
+    def client():
+        return AWS_L2A.clients.get() if AWS_L2A.clients is not None else AWS_L2A.s3_client
 
     @staticmethod
     def get_l2a_prod_dir (sceneid):
-        return f'products/{s2_meta.SceneID.year(sceneid)}' \
-               f'/{s2_meta.SceneID.month(sceneid,type=int)}' \
-               f'/{s2_meta.SceneID.day(sceneid,type=int)}' \
-               f'/{sceneid}'
+        acqdate = S2SceneIDs.get(sceneid).datetime
+        return f'products/{acqdate.year}/{acqdate.month}/{acqdate.day}/{sceneid}'
 
     @staticmethod
     def get_l2a_tile_dir(sceneid):
-        return f'tiles/{s2_meta.SceneID.tile_name(sceneid)[0:2]}' \
-               f'/{s2_meta.SceneID.tile_name(sceneid)[2:3]}' \
-               f'/{s2_meta.SceneID.tile_name(sceneid)[3:5]}' \
-               f'/{s2_meta.SceneID.year(sceneid)}' \
-               f'/{s2_meta.SceneID.month(sceneid,type=int)}' \
-               f'/{s2_meta.SceneID.day(sceneid,type=int)}'
+        scene = S2SceneIDs.get(sceneid)
+        # utm zone isn't zero padded: tiles/7/W/FR/...
+        return f'tiles/{int(scene.tile[0:2])}/{scene.tile[2:3]}/{scene.tile[3:5]}' \
+               f'/{scene.datetime.year}/{scene.datetime.month}/{scene.datetime.day}'
 
     @staticmethod
-    def download_l2a_scene (sceneid, dest_folder):
+    def download_l2a_scene (sceneid, dest_folder, max_workers=8, manifest=None):
+        """
+        Downloads tile folder and product folder of L2A scene into dest_folder/sceneid.
+        Files are downloaded in parallel by max_workers threads with shared AWS_L2A.client().
+
+        Returns:
+            TransferResult, if scene isn't available result has no objects and scene folder is removed
+        """
         scene_path = os.path.join(dest_folder,sceneid)
         if not os.path.exists(scene_path):
             os.mkdir(scene_path)
 
+        s3_client = AWS_L2A.client()
+        result = S3.download_prefix(s3_client, AWS_L2A.l2a_bucket, AWS_L2A.get_l2a_tile_dir(sceneid),
+                                    scene_path, True, max_workers, manifest=manifest)
+        if result.objects + result.skipped == 0:
+            if len(os.listdir(scene_path)) == 0: os.rmdir(scene_path)
+            return result
+
+        result.merge(S3.download_prefix(s3_client, AWS_L2A.l2a_bucket, AWS_L2A.get_l2a_prod_dir(sceneid),
+                                        scene_path, True, max_workers, manifest=manifest))
+        return result
+
     @staticmethod
     def download_bands(sceneid,bands,dest_folder):
         return True
@@ -47,16 +77,35 @@ class AWS_L2A:
 
 class AWS_COG:
     s3_client = None
+    clients = None
     bucket = 'sentinel-cogs'
     root_dir = 'sentinel-s2-l2a-cogs'
     base_url = 'https://sentinel-cogs.s3.us-west-2.amazonaws.com'
+    listing_cache = None
+    # listing of a month is cached forever if the month ended more than settle_days ago
+    settle_days = 7
     #S2B_39UVB_20190818_0_L2A
 
     @staticmethod
-    def init(aws_access_key_id, aws_secret_access_key):
-        AWS_COG.s3_client = boto3.client('s3',
-                                     aws_access_key_id=aws_access_key_id,
-                                     aws_secret_access_key=aws_secret_access_key)
+    def init(aws_access_key_id, aws_secret_access_key, listing_cache_path=None, listing_cache_ttl=24*3600,
+             **client_options):
+        """client_options (max_pool_connections, max_attempts, timeouts, per_thread) are passed to ClientManager."""
+        AWS_COG.clients = ClientManager(aws_access_key_id=aws_access_key_id,
+                                        aws_secret_access_key=aws_secret_access_key,
+                                        **client_options)
+        AWS_COG.s3_client = AWS_COG.clients.get()
+        if listing_cache_path is not None:
+            AWS_COG.listing_cache = ListingCache(listing_cache_path, listing_cache_ttl)
+
+    @staticmethod
+    def client():
+        return AWS_COG.clients.get() if AWS_COG.clients is not None else AWS_COG.s3_client
+
+    @staticmethod
+    def is_month_settled(year, month):
+        next_month = datetime.date(int(year) + int(month) // 12, int(month) % 12 + 1, 1)
+        return datetime.date.today() >= next_month + datetime.timedelta(days=AWS_COG.settle_days)
+
     @staticmethod
     def tile(scene):
         return scene[4:9]
@@ -66,12 +115,24 @@ class AWS_COG:
         return scene[14:18]
 
     @staticmethod
-    def list_scenes_by_tile_year_month (tile,year,month, single_version_only = False):
+    def __list_scenes(remote_dir, year, month, force_refresh):
+        # listing is taken from AWS_COG.listing_cache if it's set,
+        # force_refresh skips cached entry and overwrites it
+        if AWS_COG.listing_cache is None:
+            return S3.listsubfolders(AWS_COG.client(),AWS_COG.bucket,remote_dir,True)
+        scenes = None if force_refresh else AWS_COG.listing_cache.get(AWS_COG.bucket,remote_dir)
+        if scenes is None:
+            scenes = S3.listsubfolders(AWS_COG.client(),AWS_COG.bucket,remote_dir,True)
+            AWS_COG.listing_cache.put(AWS_COG.bucket,remote_dir,scenes,AWS_COG.is_month_settled(year,month))
+        return scenes
+
+    @staticmethod
+    def list_scenes_by_tile_year_month (tile,year,month, single_version_only = False, force_refresh = False):
         remote_dir = f'{AWS_COG.root_dir}/{tile[0:2]}/{tile[2:3]}/{tile[3:5]}/{year}/{month}/'
         if not single_version_only:
-            return S3.listsubfolders(AWS_COG.s3_client,AWS_COG.bucket,remote_dir,True)
+            return AWS_COG.__list_scenes(remote_dir,year,month,force_refresh)
         else:
-            scenes = S3.listsubfolders(AWS_COG.s3_client,AWS_COG.bucket,remote_dir,True)
+            scenes = AWS_COG.__list_scenes(remote_dir,year,month,force_refresh)
             scenes_filt = dict()
             for scene in scenes:
                 date = scene[10:18]
@@ -81,6 +142,33 @@ class AWS_COG:
                     scenes_filt[date] = scene
             return list(scenes_filt.values())
 
+    @staticmethod
+    def list_scenes (tiles, start_date, end_date, single_version_only = False, force_refresh = False,
+                     max_workers = 16):
+        """
+        Lists scenes of all tiles acquired between start_date and end_date (datetime.date, inclusive).
+        Listings of every tile and month are requested concurrently by max_workers threads,
+        max_pool_connections of AWS_COG client should be not less than max_workers.
+
+        Returns:
+            SceneInventory
+        """
+        months = list()
+        year, month = start_date.year, start_date.month
+        while (year, month) <= (end_date.year, end_date.month):
+            months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            listings = executor.map(lambda args: AWS_COG.list_scenes_by_tile_year_month(*args,
+                                                                                        single_version_only,
+                                                                                        force_refresh),
+                                    [(tile, year, month) for tile in tiles for (year, month) in months])
+            scenes = [scene for listing in listings for scene in listing]
+
+        start, end = start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d')
+        return SceneInventory([scene for scene in scenes if start <= scene[10:18] <= end])
+
     @staticmethod
     def get_remote_dir_by_scene(scene):
         #S2B_39UVB_20231225_0_L2A
@@ -96,23 +184,77 @@ class AWS_COG:
         return [f'{AWS_COG.base_url}/{AWS_COG.get_remote_dir_by_scene(scene)}/{b}' for b in bands]
 
 
+COGScene = collections.namedtuple('COGScene', ['scene', 'tile', 'date', 'version', 'url_prefix'])
+
+
+class SceneInventory:
+    """
+    Table of AWS_COG scenes (COGScene rows) sorted by tile, date and version,
+    indexed by tile and by acquisition date.
+    """
+
+    def __init__(self, scenes):
+        self.rows = [COGScene(scene,
+                              AWS_COG.tile(scene),
+                              datetime.datetime.strptime(scene[10:18], '%Y%m%d').date(),
+                              int(scene[19:20]),
+                              f'{AWS_COG.base_url}/{AWS_COG.get_remote_dir_by_scene(scene)}')
+                     for scene in set(scenes)]
+        self.rows.sort(key=lambda r: (r.tile, r.date, r.version))
+        self.__by_tile = collections.defaultdict(list)
+        self.__by_date = collections.defaultdict(list)
+        for row in self.rows:
+            self.__by_tile[row.tile].append(row)
+            self.__by_date[row.date].append(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def tiles(self):
+        return sorted(self.__by_tile.keys())
+
+    def by_tile(self, tile):
+        return list(self.__by_tile.get(tile, []))
+
+    def by_date(self, date):
+        return list(self.__by_date.get(date, []))
+
+    def get(self, tile, date):
+        return [row for row in self.__by_tile.get(tile, []) if row.date == date]
+
+    def write_csv(self, csv_file):
+        with open(csv_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(COGScene._fields)
+            for row in self.rows:
+                writer.writerow([row.scene, row.tile, row.date.strftime('%Y-%m-%d'), row.version, row.url_prefix])
+
+
 class GCS:
     s3_client = None
+    clients = None
     l1c_bucket = 'gcp-public-data-sentinel-2'
 
     @staticmethod
-    def init(google_access_key_id, google_access_key_secret) :
-        GCS.s3_client = boto3.client('s3',
-                                    region_name="auto",
+    def init(google_access_key_id, google_access_key_secret, **client_options) :
+        """client_options (max_pool_connections, max_attempts, timeouts, per_thread) are passed to ClientManager."""
+        GCS.clients = ClientManager(region_name="auto",
                                     endpoint_url="https://storage.googleapis.com",
                                     aws_access_key_id=google_access_key_id,
-                                    aws_secret_access_key=google_access_key_secret)
+                                    aws_secret_access_key=google_access_key_secret,
+                                    **client_options)
+        GCS.s3_client = GCS.clients.get()
+
+    @staticmethod
+    def client():
+        return GCS.clients.get() if GCS.clients is not None else GCS.s3_client
 
     def get_l1c_dir (sceneid):
-        return  f'tiles/{s2_meta.SceneID.tile_name(sceneid)[0:2]}' \
-                f'/{s2_meta.SceneID.tile_name(sceneid)[2:3]}' \
-                f'/{s2_meta.SceneID.tile_name(sceneid)[3:5]}' \
-                f'/{sceneid}.SAFE'
+        tile = S2SceneIDs.get(sceneid).tile
+        return f'tiles/{tile[0:2]}/{tile[2:3]}/{tile[3:5]}/{sceneid}.SAFE'
 
             # products/2021/5/15/S2A_MSIL2A_20210515T004641_N0300_R045_T56TNS_20210515T025256/
 # Key: products/2021/5/15/S2A_MSIL2A_20210515T004641_N0300_R045_T56UNU_20210515T025256/metadata.xml
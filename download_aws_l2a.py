@@ -1,11 +1,25 @@
 import os
 import sys
+import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from downloader.data_buckets import AWS_L2A
+from downloader.manifest import TransferManifest
+from downloader.metadata_collection import MetadataCollection
 
-parser = argparse.ArgumentParser(description = 'Download products by parsing output csv file from query.py script. Requires wget')
+parser = argparse.ArgumentParser(description = ('Download S2 L2A products from AWS bucket sentinel-s2-l2a '
+                                                'by parsing output csv file from query.py script. '
+                                                'Prints json line with download result per scene'))
 
 parser.add_argument('-i',required=True, metavar='input csv', help='Input csv file')
 parser.add_argument('-o', required=True, metavar='output foder', help='Output folder')
+parser.add_argument('-w', type=int, default=4, metavar='scenes workers',
+                    help='Number of scenes downloaded in parallel, default 4')
+parser.add_argument('-c', type=int, default=8, metavar='files workers',
+                    help='Number of files downloaded in parallel per scene, default 8')
+parser.add_argument('-manifest', required=False, metavar='manifest file',
+                    help='Transfer manifest (sqlite) path to resume interrupted run, '
+                         'default: download_manifest.db in output folder')
 
 
 
@@ -16,28 +30,33 @@ if (len(sys.argv)==1):
 args = parser.parse_args()
 
 
+def download_scene (sceneid) :
+    try:
+        result = AWS_L2A.download_l2a_scene(sceneid, args.o, args.c, manifest)
+    except Exception as inst:
+        return {'scene': sceneid, 'status': 'failed', 'error_msg': str(inst)}
 
-with open(args.i) as f:
-    lines = f.read().splitlines()
-lines.pop(0)
-os.chdir(args.o)
-for l in lines:
-    columns = l.split(',')
-    if not os.path.exists(columns[1]):
-        os.mkdir(columns[1])
-    command = ('aws s3 cp "s3://sentinel-s2-l2a/tiles/'
-              + str(int(columns[1][39:41])) + '/' + columns[1][41:42] + '/' + columns[1][42:44] + '/'
-              + columns[1][11:15] + '/' + str(int(columns[1][15:17])) + '/' + str(int(columns[1][17:19])) + '" "' + columns[1] + '" '
-              + '--recursive --request-payer requester')
-    os.system(command + ' > /dev/null')
-    if len(os.listdir(columns[1]))==0:
-        print(columns[1] + " - isn't available on AWS")
-        os.rmdir(columns[1])
-        continue
-
-    command = ('aws s3 cp "s3://sentinel-s2-l2a/products/'
-      + columns[1][11:15] + '/' + str(int(columns[1][15:17])) + '/' + str(int(columns[1][17:19])) + '/' + columns[1]
-      + '" "' + columns[1] + '" '  + ' --recursive --request-payer requester')
-
-    os.system(command + ' > /dev/null')
-    print(columns[1])
+    if result.objects + result.skipped == 0 and len(result.failures) == 0:
+        status = 'unavailable'
+    else:
+        status = 'success' if result else 'failed'
+    return {'scene': sceneid, 'status': status, 'objects': result.objects, 'bytes': result.bytes,
+            'skipped': result.skipped, 'failures': [{'key': k, 'error_msg': e} for k, e in result.failures]}
+
+
+# appended csv files may list the same scene several times
+sceneids = MetadataCollection.read_csv(args.i).dedup()['sceneid'].tolist()
+
+# every scene worker runs up to args.c file transfers through one shared client
+AWS_L2A.init(max_pool_connections=args.w * args.c)
+manifest = TransferManifest(args.manifest if args.manifest is not None
+                            else os.path.join(args.o, 'download_manifest.db'))
+
+# scenes are downloaded in parallel with one shared s3 client,
+# result of every scene is printed as json line as soon as it's finished
+with ThreadPoolExecutor(max_workers=args.w) as executor:
+    futures = [executor.submit(download_scene, sceneid) for sceneid in sceneids]
+    for future in as_completed(futures):
+        print(json.dumps(future.result()), flush=True)
+
+manifest.close()
@@ -12,35 +12,79 @@ import json
 import csv
 from google.cloud import storage
 from google.oauth2 import service_account
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from io import BytesIO
 import requests
+import requests.adapters
 import hashlib
 import base64
-import shutil
+import threading
+import google_crc32c
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from downloader.manifest import TransferManifest
+from downloader.retry import RetryScheduler, RetryPolicy
 
 
 
+class HashingWriter :
+    """
+    File object wrapper that computes checksum (md5 or crc32c) of data while it's written.
+    """
+
+    def __init__(self,file,checksum='md5') :
+        self.file = file
+        self.checksum = checksum
+        self.hash = HashingWriter.new_hash(checksum)
+
+    @staticmethod
+    def new_hash(checksum) :
+        return hashlib.md5() if checksum == 'md5' else google_crc32c.Checksum()
+
+    def write(self,data) :
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self,name) :
+        return getattr(self.file,name)
+
+    #Returns checksum in the same format as blob.md5_hash/blob.crc32c: base64 of big-endian digest
+    def b64digest(self) :
+        return base64.b64encode(self.hash.digest()).decode()
+
+    #Computes checksum of existing file reading it by chunks
+    @staticmethod
+    def file_b64digest(filename,checksum='md5',chunk_size=1024*1024) :
+        file_hash = HashingWriter.new_hash(checksum)
+        with open(filename,'rb') as f :
+            for chunk in iter(lambda: f.read(chunk_size), b'') :
+                file_hash.update(chunk)
+        return base64.b64encode(file_hash.digest()).decode()
+
+
 class BucketFolder :
     """
     Represents abstract Google Storage bucket that contains blobs (files or folders).
     """
 
-    def __init__(self,bucket_name,bucket_prefix):
+    def __init__(self,bucket_name,bucket_prefix,storage_client=None,checksum='md5'):
+        """
+        Args:
+            checksum (string): 'md5' or 'crc32c', blobs without md5 (composite objects)
+                are always checked by crc32c
+        """
         self.bucket_name = bucket_name
         self.bucket_prefix = bucket_prefix
+        self.storage_client = storage_client if storage_client is not None else storage.Client()
+        self.checksum = checksum
 
-    #Alien method, should be removed
-    @staticmethod
-    def __file_as_bytes(file) :
-        with file:
-            return file.read()
- 
 
-    #Compares file blob and file on disk
-    @staticmethod
-    def __is_blob_copy_correct (blob, filename) :
-        file_md5_hash = base64.b64encode(hashlib.md5(BucketFolder.__file_as_bytes(open(filename, 'rb'))).digest())
-        return True if (file_md5_hash.decode() == blob.md5_hash) else False
+    #Returns checksum type used for blob and checksum value from blob metadata
+    def __get_blob_checksum (self, blob) :
+        if self.checksum == 'md5' and blob.md5_hash is not None :
+            return 'md5', blob.md5_hash
+        else :
+            return 'crc32c', blob.crc32c
 
 
     @staticmethod
@@ -59,41 +103,103 @@ class BucketFolder :
             return (blob.name[:blob.name.rfind('/')])[len(self.bucket_prefix):]
 
 
+    def __get_manifest_key (self, blob) :
+        return 'gs://' + self.bucket_name + '/' + blob.name
+
+
+    #Checks if local file has the same size and checksum as blob
+    @staticmethod
+    def __is_local_copy_current (filename, blob_size, checksum_type, checksum) :
+        if not os.path.exists(filename) or os.path.getsize(filename) != blob_size : return False
+        return HashingWriter.file_b64digest(filename,checksum_type) == checksum
+
+
     #Downloads single blog to disk file
-    def __download_file (self,blob,dest_folder) :
+    #Skips blob if manifest says it's already downloaded and verified,
+    #in sync mode also skips blob if local file has the same size and checksum
+    def __download_file (self,blob,dest_folder,manifest=None,sync=False) :
         dest_filename = self.__get_filename(blob)
         dest_path = dest_folder + self.__get_relative_path(blob)
         os.makedirs(dest_path,exist_ok=True)
         dest_full_path = dest_path + '/' + dest_filename
-        blob.download_to_filename(dest_full_path)
-        if not BucketFolder.__is_blob_copy_correct(blob,dest_full_path) :
+        checksum_type, checksum = self.__get_blob_checksum(blob)
+        key = self.__get_manifest_key(blob)
+        if manifest is not None and manifest.is_complete(key,blob.size,checksum,dest_full_path) :
+            return True
+        if sync and BucketFolder.__is_local_copy_current(dest_full_path,blob.size,checksum_type,checksum) :
+            if manifest is not None :
+                manifest.start(key,blob.size,checksum)
+                manifest.complete(key)
+            return True
+        if manifest is not None : manifest.start(key,blob.size,checksum)
+        #checksum is computed on the fly, so file isn't read again after download
+        with open(dest_full_path,'wb') as f :
+            writer = HashingWriter(f,checksum_type)
+            blob.download_to_file(writer,checksum=None)
+        if writer.b64digest() != checksum :
             os.remove(dest_full_path)
             return False
-        else: return True
+        else:
+            if manifest is not None : manifest.complete(key)
+            return True
+
 
+    #Scheduler task: failed checksum is raised as exception to be retried
+    def __download_blob (self,blob,dest_folder,manifest,sync) :
+        if not self.__download_file(blob,dest_folder,manifest,sync) :
+            raise Exception('checksum mismatch: ' + blob.name)
+        return True
 
-    def try_download_all (self, dest_path) :
+
+    def try_download_all (self, dest_path, manifest=None, max_workers=1, sync=False, scheduler=None) :
         """
         Tries to downloads all blobs inside folder (=bucket_prefix). 
         Preserves all structure: file names, folder names, nesting
 
         Args:
             dest_path (string): destination path on local disk
+            manifest (TransferManifest): if passed then blobs already downloaded
+                into dest_path are skipped, all transfers are recorded in it
+            max_workers (int): number of blobs of this folder downloaded in parallel
+                (also if scheduler is shared)
+            sync (bool): compare existing files in dest_path with blobs (size and checksum)
+                and download only missing or changed ones
+            scheduler (RetryScheduler): runs blob downloads with retries, may be shared
+                by several folders, if it's None then scheduler with max_workers is created
 
         Return:
             bool if success otherwise raise Exception 
         """
-        storage_client = storage.Client()
-        blobs = storage_client.list_blobs(self.bucket_name,prefix=self.bucket_prefix)
+        blobs = self.storage_client.list_blobs(self.bucket_name,prefix=self.bucket_prefix)
 
         scene_exists = False
+        failed_blobs = list()
+
+        own_scheduler = scheduler is None
+        if own_scheduler : scheduler = RetryScheduler(max_workers)
 
+        #blobs are submitted only while folder has less than max_workers unfinished downloads,
+        #so folder doesn't fill queue of shared scheduler and other folders are downloaded at the same time
+        slots = threading.Semaphore(max_workers)
+        futures = dict()
         for blob in blobs:
             scene_exists = True
             if not self.__is_blob_a_folder(blob) :
-                if not self.__download_file(blob,dest_path) : 
-                    raise Exception('file download failure: ' + blob.name)
-        
+                slots.acquire()
+                future = scheduler.submit(self.__download_blob,blob,dest_path,manifest,sync)
+                future.add_done_callback(lambda f: slots.release())
+                futures[future] = blob.name
+        for future in as_completed(futures) :
+            #exception of the last attempt is kept, so e.g. permission error isn't reported as timeout
+            if future.exception() is not None : failed_blobs.append((futures[future],future.exception()))
+
+        if own_scheduler : scheduler.shutdown()
+
+        if len(failed_blobs) > 0 :
+            raise Exception('file download failure: ' +
+                            '; '.join(name + ': ' + type(inst).__name__ + ': ' + str(inst)
+                                      for name, inst in failed_blobs))
+
         if not scene_exists : 
             raise Exception("Scene doesn't exist: " + self.bucket_prefix)
         else : return True
@@ -104,8 +210,8 @@ class S2BucketFolder(BucketFolder) :
     Represents Sentinel 2 bucket on Google Storage that contains 
     files and folders of Sentinel 2 data structure
     """
-    def __init__(self,bucket_prefix) :
-        super(S2BucketFolder,self).__init__('gcp-public-data-sentinel-2',bucket_prefix)
+    def __init__(self,bucket_prefix,storage_client=None,checksum='md5') :
+        super(S2BucketFolder,self).__init__('gcp-public-data-sentinel-2',bucket_prefix,storage_client,checksum)
    
     @staticmethod
     def get_prefix_by_sceneid (sceneid) :
@@ -116,8 +222,8 @@ class L8BucketFolder(BucketFolder) :
     """
     Represents Landsat 8 bucket on Google Storage that contains files of Landsat 8 data structure
     """
-    def __init__(self,bucket_prefix) :
-        super(L8BucketFolder,self).__init__('gcp-public-data-landsat',bucket_prefix)
+    def __init__(self,bucket_prefix,storage_client=None,checksum='md5') :
+        super(L8BucketFolder,self).__init__('gcp-public-data-landsat',bucket_prefix,storage_client,checksum)
 
     @staticmethod
     def get_prefix_by_sceneid (sceneid) :
@@ -130,7 +236,10 @@ class L8BucketFolder(BucketFolder) :
 # 1. Parse input args
 # 2. Loop through rows of input csv file which contains sceneids of L8/S2
 # 3. For each scneneid creates BucketFolder instance and tries to download 
-#    all data into separate folder. If error happens it is store to error list
+#    all data into separate folder. If error happens it is store to error list.
+#    Scenes are downloaded in parallel (-w), files of every scene as well (-c)
+#    Downloaded files are recorded in manifest, so if the script is restarted
+#    then only files that weren't downloaded and verified are requested again
 # 4. Saves errors log file
 #  
 #################################################################################
@@ -147,6 +256,21 @@ parser.add_argument('-cred', required=True, metavar='Google credentials json fil
                     help = 'Google credentials json file, required for authorization')
 parser.add_argument('-log', required=True, metavar='errors log',  
                     help= 'Errors file log path')
+parser.add_argument('-manifest', required=False, metavar='manifest file',
+                    help= 'Transfer manifest (sqlite) path to resume interrupted run, '
+                          'default: download_manifest.db in output folder')
+parser.add_argument('-w', type=int, default=4, metavar='scenes workers',
+                    help= 'Number of scenes downloaded in parallel, default 4')
+parser.add_argument('-c', type=int, default=8, metavar='files workers',
+                    help= 'Number of files downloaded in parallel per scene, default 8. '
+                          'Total number of parallel downloads (w*c) is reduced while server throttles requests')
+parser.add_argument('-attempts', type=int, default=5, metavar='download attempts',
+                    help= 'Number of attempts to download a file, default 5')
+parser.add_argument('-checksum', default='md5', choices=['md5','crc32c'],
+                    help= 'Checksum computed while downloading to verify files, default md5')
+parser.add_argument('-sync', action='store_true',
+                    help= 'Update existing scene folders: files are compared with blobs by size '
+                          'and checksum, only missing or changed files are downloaded')
 
 
 if (len(sys.argv) == 1) :
@@ -158,45 +282,72 @@ input_csv = args.i
 output_path = args.o
 log_file = args.log
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = args.cred
+# manifest database is created in output folder by default, so folder must exist before it's opened
+os.makedirs(output_path,exist_ok=True)
+manifest = TransferManifest(args.manifest if args.manifest is not None
+                            else os.path.join(output_path,'download_manifest.db'))
 
-num_success = 0
-num_error = 0
 download_attempts = 2
-interval_long_sec = 300
-interval_sec = 10
-failed_scenes = list()
+# failed file downloads wait for retry with exponential backoff and jitter while
+# other downloads go on, 429/503 responses reduce number of parallel downloads
+retry_policy = RetryPolicy(max_attempts=args.attempts)
+scheduler = RetryScheduler(args.w * args.c, retry_policy)
+
+# one storage client (and its connection pool) is shared by all scenes and blobs,
+# pool is sized to the number of concurrent blob transfers
+credentials, project = google.auth.load_credentials_from_file(args.cred, scopes=storage.Client.SCOPE)
+http_session = AuthorizedSession(credentials)
+http_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=args.w * args.c))
+storage_client = storage.Client(project=project, credentials=credentials, _http=http_session)
+
+
+def download_scene (bucket_folder, dest_folder) :
+    """Returns error message or None if scene is downloaded."""
+    full_path = output_path +'/' + dest_folder
+    # scene folder from previous run is checked against manifest (and local files
+    # checksums in sync mode) and completed instead of being downloaded again from scratch
+    temp_path = full_path if os.path.exists(full_path) else full_path + '__temp'
+
+    for i in range(0,download_attempts) :
+        try :
+            bucket_folder.try_download_all(temp_path,manifest,args.c,args.sync,scheduler)
+            if temp_path != full_path : os.rename(temp_path,full_path)
+            return None
+        except Exception as inst: 
+            if (i==download_attempts-1) :
+                return str(inst)
+            else :
+                # blocks only this scene, files were already retried by scheduler
+                time.sleep(retry_policy.delay(i+1))
+
+
+scenes = list()
 with open(input_csv,newline='') as csvfile :
     csvreader = csv.reader(csvfile, delimiter=',', quotechar='|')
     for row in csvreader :
-        dest_folder = None
-        bucket_folder = None
         if len(row)<=1 : continue 
 
         if (row[0]=='Sentinel 2') :
-            bucket_folder = S2BucketFolder(S2BucketFolder.get_prefix_by_sceneid(row[1]))
-            dest_folder = row[1]+'.SAFE'
+            scenes.append((S2BucketFolder(S2BucketFolder.get_prefix_by_sceneid(row[1]),storage_client,args.checksum),
+                           row[1]+'.SAFE'))
         elif (row[0]=='Landsat 8'):
-            bucket_folder = L8BucketFolder(L8BucketFolder.get_prefix_by_sceneid(row[2]))
-            dest_folder = row[1]
-        else : continue
-        
-        full_path = output_path +'/' + dest_folder
-        if (os.path.exists(full_path)): shutil.rmtree(full_path)
-             
-        for i in range(0,download_attempts) :
-            try :
-                bucket_folder.try_download_all(full_path + '__temp')
-                os.rename(full_path + '__temp',full_path)
-                num_success+=1
-                break
-            except Exception as inst: 
-                if (i==download_attempts-1) :
-                    failed_scenes.append({"scene":dest_folder,
-                                        "error_msg" :str(inst)})
-                    num_error+=1
-                else :
-                    if (str(inst)[0:4]=='503') : time.sleep(interval_long_sec)
-                    else : time.sleep(interval_sec)
+            scenes.append((L8BucketFolder(L8BucketFolder.get_prefix_by_sceneid(row[2]),storage_client,args.checksum),
+                           row[1]))
+
+num_success = 0
+num_error = 0
+failed_scenes = list()
+with ThreadPoolExecutor(max_workers=args.w) as executor :
+    futures = {executor.submit(download_scene,bucket_folder,dest_folder) : dest_folder
+               for bucket_folder, dest_folder in scenes}
+    for future in as_completed(futures) :
+        error_msg = future.result()
+        if error_msg is None :
+            num_success+=1
+        else :
+            failed_scenes.append({"scene":futures[future],
+                                  "error_msg" :error_msg})
+            num_error+=1
         
 
 if (num_error > 0) :
@@ -206,7 +357,9 @@ if (num_error > 0) :
         for e in failed_scenes :
             writer.writerow(e)
         file.close()
-        
+
+scheduler.shutdown()
+manifest.close()
 print ("Success downloads: " + str(num_success))
 print ("Failed downloads: " + str(num_error))
 exit(0)
\ No newline at end of file
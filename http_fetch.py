@@ -0,0 +1,110 @@
+import os
+import random
+import asyncio
+import functools
+import aiohttp
+from downloader.data_buckets import AWS_COG
+
+
+class AsyncFetcher:
+    """
+    Downloads files by HTTP(S) with asyncio. Thousands of requests may be scheduled at once,
+    they are served by a small pool of keep-alive connections limited in total (max_connections)
+    and per host (max_per_host). Responses are streamed to disk by chunks,
+    failed requests (connection errors, timeouts, 5xx and 429 responses) are retried
+    with exponential backoff and jitter without blocking other requests.
+    There is no total timeout of request: requests wait for free connection in pool as long as needed,
+    only connecting (connect_timeout) and waiting for data from server (timeout) are limited.
+    File operations are run in default thread pool executor, so they don't block event loop.
+    """
+    chunk_size = 1024 * 1024
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_connections=32, max_per_host=16, max_attempts=5, timeout=300, backoff=1.0,
+                 connect_timeout=30):
+        """
+        Args:
+            timeout: max time in seconds of waiting for data from server (socket read)
+            connect_timeout: max time in seconds of connecting to server
+        """
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.backoff = backoff
+
+    @staticmethod
+    async def __run_io(func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    def __remove_part_file(output_path):
+        if os.path.exists(output_path + '.part'): os.remove(output_path + '.part')
+
+    async def __fetch_once(self, session, url, output_path):
+        async with session.get(url) as response:
+            if response.status != 200:
+                return response.status, 0
+            await AsyncFetcher.__run_io(os.makedirs, os.path.dirname(output_path) or '.', exist_ok=True)
+            size = 0
+            # file is written under temp name and renamed when download is complete
+            f = await AsyncFetcher.__run_io(open, output_path + '.part', 'wb')
+            try:
+                async for chunk in response.content.iter_chunked(AsyncFetcher.chunk_size):
+                    await AsyncFetcher.__run_io(f.write, chunk)
+                    size += len(chunk)
+            finally:
+                await AsyncFetcher.__run_io(f.close)
+            await AsyncFetcher.__run_io(os.replace, output_path + '.part', output_path)
+            return 200, size
+
+    async def __fetch(self, session, url, output_path):
+        result = {'url': url, 'path': output_path, 'status': None, 'bytes': 0, 'attempts': 0, 'error_msg': None}
+        for attempt in range(self.max_attempts):
+            result['attempts'] = attempt + 1
+            try:
+                result['status'], result['bytes'] = await self.__fetch_once(session, url, output_path)
+                result['error_msg'] = None
+                if result['status'] not in AsyncFetcher.retry_statuses: break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as inst:
+                result['error_msg'] = str(inst) or type(inst).__name__
+                await AsyncFetcher.__run_io(AsyncFetcher.__remove_part_file, output_path)
+            if attempt < self.max_attempts - 1:
+                await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+        return result
+
+    async def fetch_all(self, items):
+        """
+        Args:
+            items: list of (url, output_path)
+
+        Returns:
+            list of dicts (url, path, status, bytes, attempts, error_msg) in the same order as items
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host)
+        # total timeout would include waiting for connection from pool, so queued requests
+        # would time out before they are sent
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            return await asyncio.gather(*[self.__fetch(session, url, path) for url, path in items])
+
+    def run(self, items):
+        """Synchronous wrapper of fetch_all."""
+        return asyncio.run(self.fetch_all(items))
+
+    @staticmethod
+    def get_cog_scene_items(scene, dest_folder, bands=True, scl=True):
+        """
+        Returns (url, output_path) pairs of AWS_COG 10m bands and/or SCL of scene,
+        files are saved into dest_folder/scene.
+        """
+        urls = list()
+        if bands: urls += AWS_COG.get_10m_bands_urls(scene)
+        if scl: urls.append(AWS_COG.get_scl_url(scene))
+        return [(url, os.path.join(dest_folder, scene, url[url.rfind('/') + 1:])) for url in urls]
+
+    def fetch_cog_scenes(self, scenes, dest_folder, bands=True, scl=True):
+        """Downloads 10m bands and SCL files of all scenes at once. See fetch_all."""
+        return self.run([item for scene in scenes
+                         for item in AsyncFetcher.get_cog_scene_items(scene, dest_folder, bands, scl)])
@@ -0,0 +1,56 @@
+import json
+import time
+import sqlite3
+import threading
+
+
+class ListingCache:
+    """
+    Persistent (sqlite) cache of bucket listings keyed by bucket and prefix.
+    Entries expire after ttl seconds unless they are stored as permanent
+    (listings that are known not to change). Can be shared between threads.
+    """
+
+    def __init__(self, db_path, ttl=24 * 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('CREATE TABLE IF NOT EXISTS listings ('
+                            'bucket TEXT, '
+                            'prefix TEXT, '
+                            'items TEXT, '
+                            'fetched REAL, '
+                            'permanent INTEGER, '
+                            'PRIMARY KEY (bucket, prefix))')
+        self.__conn.commit()
+
+    def get(self, bucket, prefix):
+        """Returns cached list of items or None if there is no entry or it's expired."""
+        with self.__lock:
+            row = self.__conn.execute('SELECT items, fetched, permanent FROM listings '
+                                      'WHERE bucket = ? AND prefix = ?', (bucket, prefix)).fetchone()
+        if row is None: return None
+        if not row[2] and time.time() - row[1] > self.ttl: return None
+        return json.loads(row[0])
+
+    def put(self, bucket, prefix, items, permanent=False):
+        with self.__lock:
+            self.__conn.execute('INSERT OR REPLACE INTO listings (bucket, prefix, items, fetched, permanent) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (bucket, prefix, json.dumps(list(items)), time.time(), 1 if permanent else 0))
+            self.__conn.commit()
+
+    def invalidate(self, bucket, prefix=None):
+        """Removes entry of prefix or all entries of bucket if prefix is None."""
+        with self.__lock:
+            if prefix is None:
+                self.__conn.execute('DELETE FROM listings WHERE bucket = ?', (bucket,))
+            else:
+                self.__conn.execute('DELETE FROM listings WHERE bucket = ? AND prefix = ?', (bucket, prefix))
+            self.__conn.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
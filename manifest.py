@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import threading
+
+
+class TransferManifest:
+    """
+    Persistent (sqlite) record of object transfers: object key, size, ETag/md5 and state.
+    An object is registered as 'pending' before transfer and marked 'done' after
+    it's downloaded and verified. So a restarted batch download skips objects
+    that are already on disk and repeats only interrupted ones.
+    Can be shared between threads.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('CREATE TABLE IF NOT EXISTS objects ('
+                            'key TEXT PRIMARY KEY, '
+                            'size INTEGER, '
+                            'etag TEXT, '
+                            'state TEXT)')
+        self.__conn.commit()
+
+    def __execute(self, sql, params):
+        with self.__lock:
+            self.__conn.execute(sql, params)
+            self.__conn.commit()
+
+    def start(self, key, size, etag):
+        """Registers object transfer as started (pending)."""
+        self.__execute('INSERT OR REPLACE INTO objects (key, size, etag, state) VALUES (?, ?, ?, ?)',
+                       (key, size, etag, TransferManifest.PENDING))
+
+    def complete(self, key):
+        """Marks object transfer as finished and verified."""
+        self.__execute('UPDATE objects SET state = ? WHERE key = ?', (TransferManifest.DONE, key))
+
+    def get(self, key):
+        """Returns (size, etag, state) or None if object isn't registered."""
+        with self.__lock:
+            return self.__conn.execute('SELECT size, etag, state FROM objects WHERE key = ?',
+                                       (key,)).fetchone()
+
+    def is_complete(self, key, size, etag, local_path):
+        """
+        Checks if object with the same size and ETag/md5 was completely downloaded
+        and file of the same size still exists at local_path.
+        """
+        row = self.get(key)
+        if row is None or row[2] != TransferManifest.DONE: return False
+        if row[0] != size or row[1] != etag: return False
+        return os.path.exists(local_path) and os.path.getsize(local_path) == size
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
@@ -0,0 +1,79 @@
+import numpy as np
+from osgeo import gdal
+
+
+class MaskLUT:
+    """
+    Lookup table: QA value (uint8 SCL classes, uint16 QA_PIXEL bits) -> mask value (uint8).
+    The rule is evaluated once for all possible values, then mask of raster is a single gather lut[qa]
+    without temporary arrays of chained comparisons. Rasters are processed by blocks of rows,
+    so memory doesn't depend on raster size.
+    """
+    block_rows = 1024
+    # lut is applied by chunks of pixels, so temporary index array stays in CPU cache
+    chunk_size = 256 * 1024
+
+    def __init__(self, rule, bits=16):
+        """
+        Args:
+            rule: function(qa array) -> array of mask values, e.g. lambda qa: np.where(qa == 4, 1, 0)
+            bits: 8 or 16, size of table is 2**bits
+        """
+        self.rule = rule
+        self.bits = bits
+        self.lut = np.asarray(rule(np.arange(2 ** bits, dtype=np.uint16 if bits == 16 else np.uint8))).astype(np.uint8)
+
+    @staticmethod
+    def from_classes(valid_classes, bits=8):
+        """Mask is 1 for QA values from valid_classes list, 0 for the rest."""
+        return MaskLUT(lambda qa: np.isin(qa, valid_classes).astype(np.uint8), bits)
+
+    def apply(self, qa):
+        """Returns uint8 mask of the same shape as qa."""
+        qa = np.asarray(qa)
+        if qa.dtype.kind == 'u' and qa.dtype.itemsize * 8 <= self.bits:
+            qa_flat = np.ascontiguousarray(qa).reshape(-1)
+            mask = np.empty(qa_flat.shape, dtype=np.uint8)
+            for i in range(0, len(qa_flat), MaskLUT.chunk_size):
+                np.take(self.lut, qa_flat[i:i + MaskLUT.chunk_size], out=mask[i:i + MaskLUT.chunk_size])
+            return mask.reshape(qa.shape)
+        # other types (signed, float) are evaluated by rule itself
+        return np.asarray(self.rule(qa)).astype(np.uint8)
+
+    def iter_raster_blocks(self, raster_file, band_num=1):
+        """Yields (row offset, mask block) of raster band, block height is multiple of raster block height."""
+        ds = gdal.Open(raster_file)
+        if ds is None:
+            raise Exception('ERROR: can\'t open raster file: ' + raster_file)
+        band = ds.GetRasterBand(band_num)
+        block_height = band.GetBlockSize()[1]
+        rows = max(block_height, MaskLUT.block_rows // block_height * block_height)
+        for row_off in range(0, ds.RasterYSize, rows):
+            yield row_off, self.apply(band.ReadAsArray(0, row_off, ds.RasterXSize,
+                                                       min(rows, ds.RasterYSize - row_off)))
+
+    def calc_raster_mask(self, raster_file, band_num=1):
+        """Returns uint8 mask array of raster band, raster is read by blocks."""
+        ds = gdal.Open(raster_file)
+        if ds is None:
+            raise Exception('ERROR: can\'t open raster file: ' + raster_file)
+        mask = np.empty((ds.RasterYSize, ds.RasterXSize), dtype=np.uint8)
+        ds = None
+        for row_off, block in self.iter_raster_blocks(raster_file, band_num):
+            mask[row_off:row_off + block.shape[0]] = block
+        return mask
+
+    def write_raster_mask(self, raster_file, output_file, band_num=1):
+        """Writes uint8 mask of raster band into GeoTIFF with the same georeference block by block."""
+        ds = gdal.Open(raster_file)
+        if ds is None:
+            raise Exception('ERROR: can\'t open raster file: ' + raster_file)
+        out_ds = gdal.GetDriverByName('GTiff').Create(output_file, ds.RasterXSize, ds.RasterYSize, 1,
+                                                      gdal.GDT_Byte, ['COMPRESS=DEFLATE', 'TILED=YES'])
+        out_ds.SetGeoTransform(ds.GetGeoTransform())
+        out_ds.SetProjection(ds.GetProjection())
+        ds = None
+        out_band = out_ds.GetRasterBand(1)
+        for row_off, block in self.iter_raster_blocks(raster_file, band_num):
+            out_band.WriteArray(block, 0, row_off)
+        out_ds = None
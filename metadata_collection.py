@@ -0,0 +1,213 @@
+import csv
+import datetime
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class MetadataCollection:
+    """
+    Columnar collection of scene metadata records (fields of query.py MetadataEntity).
+    Every field is stored in contiguous numpy array (columns): strings are fixed width ascii,
+    acqdate is datetime64[s], cloudcover is float32 (nan if unknown).
+    Filters are vectorized and return new collections, so they can be chained:
+        collection.filter(tiles=['36UXU'], startdate=date(2020,5,1), cloud_max=20).dedup()
+    Rows are tuples (platform, sceneid, productid, acqdate, tileid, cloudcover) as in MetadataCatalog.
+    """
+    FIELDNAMES = ['platform', 'sceneid', 'productid', 'acqdate', 'tileid', 'cloudcover']
+    DTYPE = np.dtype([('platform', 'S10'), ('sceneid', 'S64'), ('productid', 'S64'),
+                      ('acqdate', 'datetime64[s]'), ('tileid', 'S8'), ('cloudcover', 'f4')])
+
+    def __init__(self, columns=None):
+        """
+        Args:
+            columns: dict field name -> numpy array of DTYPE[field name]
+        """
+        if columns is None:
+            columns = {name: np.empty(0, dtype=MetadataCollection.DTYPE[name])
+                       for name in MetadataCollection.FIELDNAMES}
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['sceneid'])
+
+    def __iter__(self):
+        return self.rows()
+
+    def __getitem__(self, name):
+        """Returns column, string columns as str array."""
+        column = self.columns[name]
+        return column.astype(str) if column.dtype.kind == 'S' else column
+
+    def __take(self, index):
+        return MetadataCollection({name: column[index] for name, column in self.columns.items()})
+
+    @staticmethod
+    def __string_column(values, name):
+        column = np.array(values, dtype='S')
+        if column.dtype.itemsize > MetadataCollection.DTYPE[name].itemsize:
+            raise Exception(f'ERROR: {name} value is longer than {MetadataCollection.DTYPE[name].itemsize} chars')
+        return column
+
+    @staticmethod
+    def from_columns(platform, sceneid, productid, acqdate, tileid, cloudcover):
+        """
+        Creates collection from columns (sequences of equal length): strings, acqdate as datetime
+        or datetime64 values, cloudcover as numbers or None.
+        """
+        columns = dict()
+        for name, values in (('platform', platform), ('sceneid', sceneid), ('productid', productid),
+                             ('tileid', tileid)):
+            columns[name] = MetadataCollection.__string_column(values, name).astype(MetadataCollection.DTYPE[name])
+        columns['acqdate'] = np.array(acqdate, dtype='datetime64[s]')
+        cloudcover = np.asarray(cloudcover)
+        if cloudcover.dtype == object:
+            cloudcover = np.where(np.equal(cloudcover, None), np.nan, cloudcover)
+        columns['cloudcover'] = cloudcover.astype('f4')
+        return MetadataCollection(columns)
+
+    @staticmethod
+    def from_rows(rows):
+        """Creates collection from iterable of rows."""
+        rows = list(rows)
+        if len(rows) == 0: return MetadataCollection()
+        return MetadataCollection.from_columns(*zip(*rows))
+
+    @staticmethod
+    def from_entities(entities):
+        """Creates collection from iterable of MetadataEntity."""
+        return MetadataCollection.from_rows(e.get_row() for e in entities)
+
+    @staticmethod
+    def concat(collections):
+        if len(collections) == 0: return MetadataCollection()
+        return MetadataCollection({name: np.concatenate([c.columns[name] for c in collections])
+                                   for name in MetadataCollection.FIELDNAMES})
+
+    def rows(self):
+        """Yields rows, acqdate is datetime, unknown cloudcover is None."""
+        for r in zip(*[self.columns[name].tolist() for name in MetadataCollection.FIELDNAMES]):
+            yield (r[0].decode(), r[1].decode(), r[2].decode(), r[3], r[4].decode(),
+                   None if np.isnan(r[5]) else r[5])
+
+    @staticmethod
+    def __datetime64(value, end=False):
+        # date (not datetime) is a whole day, end date is inclusive
+        if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value + datetime.timedelta(days=1) if end else value,
+                                              datetime.time())
+            return np.datetime64(value, 's') - (1 if end else 0)
+        return np.datetime64(value, 's')
+
+    def mask(self, tiles=None, startdate=None, enddate=None, platform=None, cloud_max=None, cloud_unknown=True):
+        """
+        Returns boolean array of records matching all specified conditions.
+
+        Args:
+            tiles: list of tile ids
+            startdate, enddate: date or datetime, dates are inclusive
+            cloud_max: records with unknown cloudcover pass if cloud_unknown is set
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if tiles is not None:
+            # 8 byte tile ids are compared as uint64 numbers
+            tileid = self.columns['tileid'].view('u8')
+            tiles = np.array([t.encode() for t in tiles], dtype='S8').view('u8')
+            if len(tiles) <= 16:
+                tiles_mask = np.zeros(len(self), dtype=bool)
+                for t in tiles:
+                    tiles_mask |= tileid == t
+                mask &= tiles_mask
+            else:
+                mask &= np.isin(tileid, tiles)
+        if startdate is not None:
+            mask &= self.columns['acqdate'] >= MetadataCollection.__datetime64(startdate)
+        if enddate is not None:
+            mask &= self.columns['acqdate'] <= MetadataCollection.__datetime64(enddate, end=True)
+        if platform is not None:
+            mask &= self.columns['platform'] == platform.encode()
+        if cloud_max is not None:
+            cloudcover = self.columns['cloudcover']
+            if cloud_unknown:
+                mask &= ~(cloudcover > cloud_max)
+            else:
+                mask &= cloudcover <= cloud_max
+        return mask
+
+    def filter(self, tiles=None, startdate=None, enddate=None, platform=None, cloud_max=None, cloud_unknown=True):
+        """Returns collection of records matching all specified conditions. See mask."""
+        return self.__take(self.mask(tiles, startdate, enddate, platform, cloud_max, cloud_unknown))
+
+    def dedup(self):
+        """Returns collection without repeated sceneids, the first record of sceneid is kept."""
+        _, index = np.unique(self.columns['sceneid'], return_index=True)
+        return self.__take(np.sort(index))
+
+    def sort(self, by='acqdate'):
+        return self.__take(np.argsort(self.columns[by], kind='stable'))
+
+    def __str_columns(self):
+        acqdate = np.char.replace(np.datetime_as_string(self.columns['acqdate'], unit='s'), 'T', ' ')
+        cloudcover = self.columns['cloudcover'].astype(str)
+        cloudcover[np.isnan(self.columns['cloudcover'])] = ''
+        return [self['platform'], self['sceneid'], self['productid'], acqdate, self['tileid'], cloudcover]
+
+    def write_csv(self, csv_file, append=False):
+        """Writes csv file in format of MetadataOperations.write_csv_file."""
+        with open(csv_file, 'a' if append else 'w', newline='') as file:
+            writer = csv.writer(file)
+            if not append: writer.writerow(MetadataCollection.FIELDNAMES)
+            if len(self) > 0:
+                writer.writerows(zip(*[c.tolist() for c in self.__str_columns()]))
+
+    @staticmethod
+    def read_csv(csv_file):
+        """Reads csv file written by write_csv or query.py, missing columns are left empty."""
+        with open(csv_file, newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader, None)
+            lines = [l for l in reader if len(l) > 0]
+        if header is None or len(lines) == 0: return MetadataCollection()
+
+        columns = dict()
+        for name in MetadataCollection.FIELDNAMES:
+            if name in header:
+                i = header.index(name)
+                columns[name] = np.array([l[i] if i < len(l) else '' for l in lines])
+            else:
+                columns[name] = np.full(len(lines), '')
+
+        # np.where widens short strings (e.g. empty column), so 'NaT' isn't truncated as by assignment
+        acqdate = np.char.replace(columns['acqdate'], ' ', 'T')
+        acqdate = np.where(acqdate == '', 'NaT', acqdate)
+        cloudcover = np.array([float(v) if v else np.nan for v in columns['cloudcover']], dtype='f4')
+        return MetadataCollection.from_columns(columns['platform'], columns['sceneid'], columns['productid'],
+                                               acqdate.astype('datetime64[s]'), columns['tileid'], cloudcover)
+
+    @staticmethod
+    def __check_pyarrow():
+        if pyarrow is None:
+            raise Exception('ERROR: pyarrow is required for parquet files')
+
+    def write_parquet(self, parquet_file):
+        MetadataCollection.__check_pyarrow()
+        table = pyarrow.table({
+            'platform': pyarrow.array(self['platform']),
+            'sceneid': pyarrow.array(self['sceneid']),
+            'productid': pyarrow.array(self['productid']),
+            'acqdate': pyarrow.array(self.columns['acqdate']),
+            'tileid': pyarrow.array(self['tileid']),
+            'cloudcover': pyarrow.array(self.columns['cloudcover'], from_pandas=True)})
+        pyarrow.parquet.write_table(table, parquet_file)
+
+    @staticmethod
+    def read_parquet(parquet_file):
+        MetadataCollection.__check_pyarrow()
+        table = pyarrow.parquet.read_table(parquet_file, columns=MetadataCollection.FIELDNAMES)
+        columns = [table.column(name).to_numpy(zero_copy_only=False) for name in MetadataCollection.FIELDNAMES]
+        return MetadataCollection.from_columns(*columns[0:3], columns[3].astype('datetime64[s]'),
+                                               columns[4], columns[5].astype('f4'))
@@ -14,12 +14,22 @@ import array
 import json
 import csv
 from io import BytesIO
+import hashlib
 import requests
+import requests.adapters
+from urllib3.util.retry import Retry
+import threading
+import queue
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from osgeo import gdal
 from osgeo import ogr
 from osgeo import osr
 
 from common_utils import vector_operations as vop
+from downloader.catalog import MetadataCatalog
+from downloader.data_buckets import AWS_L2A
+from downloader.tile_grid import TileGrid
 
 
 
@@ -28,16 +38,17 @@ class MetadataEntity :
     """
     Single scene metadata record. Only main fields are included.
     """
-    def __init__(self,platform,sceneid,productid,acqdate,tileid) :
+    def __init__(self,platform,sceneid,productid,acqdate,tileid,cloudcover=None) :
         self.platform = platform    # 'Sentinel 2' | 'Landsat 8'
         self.sceneid = sceneid      
         self.productid = productid
         self.acqdate = acqdate
         self.tileid = tileid
+        self.cloudcover = cloudcover
 
     @staticmethod
     def get_fieldnames () :
-        return ['platform','sceneid','productid','acqdate','tileid']
+        return ['platform','sceneid','productid','acqdate','tileid','cloudcover']
 
     
     def get_values (self) :
@@ -45,30 +56,169 @@ class MetadataEntity :
                 'sceneid':self.sceneid,
                 'productid':self.productid,
                 'acqdate':self.acqdate.strftime("%Y-%m-%d %H:%M:%S"),
-                'tileid':self.tileid}
+                'tileid':self.tileid,
+                'cloudcover':self.cloudcover}
+
+    def get_row (self) :
+        """Tuple in MetadataCatalog row format."""
+        return (self.platform,self.sceneid,self.productid,self.acqdate,self.tileid,self.cloudcover)
+
+    @staticmethod
+    def from_row (row) :
+        return MetadataEntity(*row)
     
     
 
 class MetadataOperations:
     @staticmethod
     def write_csv_file (metadata_list, csv_file, append) :
-        """Creates csv file from metadata list."""
+        """
+        Creates csv file from metadata list or any iterable of MetadataEntity (e.g. extractor's iter_all).
+        Records are written and flushed one by one as they are produced,
+        errors raised by the iterable itself are passed to the caller.
+        Records appended to existing file are written in columns of its header,
+        so files of previous versions (without cloudcover) stay consistent.
+        """
         try :
+            fieldnames = MetadataEntity.get_fieldnames()
+            write_header = True
+            if append and os.path.exists(csv_file) and os.path.getsize(csv_file) > 0 :
+                with open (csv_file, newline='') as file :
+                    fieldnames = next(csv.reader(file))
+                write_header = False
             with open (csv_file, 'a' if append else 'w' , newline='') as file :
-                writer = csv.DictWriter(file, fieldnames=MetadataEntity.get_fieldnames())
-                if not append: writer.writeheader()
+                writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
+                if write_header: writer.writeheader()
                 for e in metadata_list :
                     writer.writerow(e.get_values())
+                    file.flush()
                 file.close()
-        except :
+        except (OSError, csv.Error) :
             print ('ERROR: writing csv file: ' + csv_file)
             return False
         return True
 
+    @staticmethod
+    def merge_streams (stream_functions, max_workers, queue_size=1000) :
+        """
+        Runs every function of stream_functions (returning iterable of records) in thread pool
+        and yields records of all streams in order of arrival. At most queue_size records wait
+        in memory, so producers are paused while consumer is busy.
+        Error of single stream doesn't stop other streams, when all streams are finished
+        Exception with errors of failed streams is raised, so failed query isn't taken as empty.
+        If consumer stops early (error, KeyboardInterrupt, generator is closed) producers are stopped,
+        streams not started yet are cancelled.
+        """
+        records = queue.Queue(maxsize=queue_size)
+        stream_end = object()
+        stopped = threading.Event()
+        errors = list()
+
+        def put (e) :
+            # waits for free place in queue until consumer is stopped
+            while not stopped.is_set() :
+                try :
+                    records.put(e, timeout=0.1)
+                    return True
+                except queue.Full :
+                    pass
+            return False
+
+        def run (stream_function) :
+            if stopped.is_set() : return
+            try :
+                for e in stream_function() :
+                    if not put(e) : break
+            except Exception as inst :
+                errors.append(inst)
+            finally :
+                put(stream_end)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor :
+            for stream_function in stream_functions :
+                executor.submit(run, stream_function)
+            running = len(stream_functions)
+            try :
+                while running > 0 :
+                    e = records.get()
+                    if e is stream_end :
+                        running -= 1
+                    else :
+                        yield e
+            finally :
+                # producers blocked on full queue are released, so executor shutdown doesn't hang
+                stopped.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                while True :
+                    try :
+                        records.get_nowait()
+                    except queue.Empty :
+                        break
+
+        if len(errors) > 0 :
+            raise Exception('ERROR: ' + str(len(errors)) + ' of ' + str(len(stream_functions)) +
+                            ' queries failed: ' + '; '.join(str(inst) for inst in errors)) from errors[0]
+
+
+class RateLimiter :
+    """
+    Token bucket limiting rate of requests shared by threads:
+    up to burst requests at once, then rate requests per second.
+    """
+    def __init__(self, rate, burst=1) :
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self) :
+        """Blocks until request is allowed."""
+        while True :
+            with self.__lock :
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+                self.__last = now
+                if self.__tokens >= 1 :
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+
+class SessionFactory :
+    @staticmethod
+    def create (pool_size=10, max_retries=3, backoff_factor=1.0) :
+        """
+        Creates requests.Session that keeps alive up to pool_size connections per host
+        and retries failed requests (connection errors, 429 and 5xx responses) with exponential backoff.
+        """
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor,
+                      status_forcelist=[429, 500, 502, 503, 504], allowed_methods=None,
+                      raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
 
 class SciHubMetadataExtractor :
     base_url = 'https://scihub.copernicus.eu/dhus/search?format=json'
     page_num = 100
+
+    def __init__(self, rate_limiter=None, max_workers=4, session=None, timeout=60) :
+        """
+        Args:
+            rate_limiter (RateLimiter): shared limiter of page requests, no limit if None
+            max_workers (int): number of pages requested in parallel
+            session (requests.Session): may be shared between extractors, see SessionFactory
+            timeout (float): request timeout in seconds
+        """
+        self.rate_limiter = rate_limiter
+        self.max_workers = max_workers
+        self.session = session if session is not None else SessionFactory.create(max_workers)
+        self.timeout = timeout
     
     @staticmethod
     def __convert_bbox_to_wktpolygon (bbox) :
@@ -90,10 +240,13 @@ class SciHubMetadataExtractor :
         #tileid = [e["content"] for e in raw_entity["str"] if e["name"] == 'tileid'][0]
 
         tileid = sceneid[38:44]
-        return MetadataEntity(platform,sceneid,productid,acqdate,tileid)
+        doubles = raw_entity.get("double", [])
+        if isinstance(doubles, dict) : doubles = [doubles]
+        cloudcover = next((float(e["content"]) for e in doubles if e["name"] == 'cloudcoverpercentage'), None)
+        return MetadataEntity(platform,sceneid,productid,acqdate,tileid,cloudcover)
     
     @staticmethod
-    def __compose_q_param (vector_file, tiles, product, stardate, enddate, cloud_max) :
+    def __compose_q_param (vector_file, tiles, product, startdate, enddate, cloud_max) :
     #producttype:GRD OR producttype:SLC 
     #sensoroperationalmode:IW
     #'platformName:Sentinel-1'
@@ -140,48 +293,82 @@ class SciHubMetadataExtractor :
         """
         main method that queries SciHUB service and saves metadata into in memory list
         """
+        try :
+            return list(self.iter_all(user, pwd, vector_file, tiles, product, startdate, enddate, cloud_max))
+        except Exception as inst :
+            print (inst)
+            return ''
+
+    def iter_all (self, user, pwd, vector_file, tiles, product, startdate, enddate, cloud_max) :
+        """
+        Queries SciHUB service and yields MetadataEntity records page by page as responses arrive.
+        Raises Exception if request fails.
+        """
         q_param = (SciHubMetadataExtractor.
                     __compose_q_param(vector_file,tiles, product,startdate,enddate,cloud_max))
+        # raised instead of returning nothing, so caller doesn't take date window as requested
         if (q_param=='') :
-            print ("ERROR: can't compose query string")
-            return list()
+            raise Exception("ERROR: can't compose query string")
+
+        # first page gives total number of results, the rest of pages are requested in parallel
+        json_response = self.__request_page(user, pwd, q_param, 0)
+        total = int(json_response["feed"]["opensearch:totalResults"])
+        if (total == 0) :
+            return
+        yield from SciHubMetadataExtractor.__convert_page(json_response)
+
+        # pages are yielded in order, no more than 2*max_workers responses are requested ahead
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor :
+            pending = collections.deque()
+            for start in range(SciHubMetadataExtractor.page_num, total, SciHubMetadataExtractor.page_num) :
+                pending.append(executor.submit(self.__request_page, user, pwd, q_param, start))
+                if len(pending) >= 2 * self.max_workers :
+                    yield from SciHubMetadataExtractor.__convert_page(pending.popleft().result())
+            while len(pending) > 0 :
+                yield from SciHubMetadataExtractor.__convert_page(pending.popleft().result())
+
+    def __request_page (self, user, pwd, q_param, start) :
+        if self.rate_limiter is not None : self.rate_limiter.acquire()
+        query_base = SciHubMetadataExtractor.base_url
+        query_base+='&start='+str(start) + '&rows='+str(SciHubMetadataExtractor.page_num)
+        r = self.session.post(query_base,{"q":q_param},auth=(user,pwd),timeout=self.timeout)
+        if (r.status_code!=200) :
+            raise Exception('ERROR: ' + str(r.status_code))
+        return json.loads(r.text)
 
-        start = 0
-        list_result = list()
-        while True :
-            query_base = SciHubMetadataExtractor.base_url
-            query_base+='&start='+str(start) + '&rows='+str(SciHubMetadataExtractor.page_num)
-            r = requests.post(query_base,{"q":q_param},auth=(user,pwd))
-            if (r.status_code!=200) :
-                print ('ERROR: ' + str(r.status_code))
-                return ''
-            json_response = json.loads(r.text)
-            total = int(json_response["feed"]["opensearch:totalResults"])
-            if (total == 0) :
-                return list_result
-            
-            raw_entities = json_response["feed"]["entry"]
-            if total == 1:
-                t = list()
-                t.append(raw_entities)
-                raw_entities = t.copy()
-
-            for re in raw_entities :
-                list_result.append(SciHubMetadataExtractor.__convert_raw_entity(re)) 
-            
-            if (start + SciHubMetadataExtractor.page_num >= total) :
-                break
-            else :
-                start+=SciHubMetadataExtractor.page_num
-            
-        return list_result
+    @staticmethod
+    def __convert_page (json_response) :
+        raw_entities = json_response["feed"].get("entry", list())
+        # single entry isn't wrapped into list
+        if isinstance(raw_entities, dict) :
+            raw_entities = [raw_entities]
+        return [SciHubMetadataExtractor.__convert_raw_entity(re) for re in raw_entities]
     
 
 class USGSMetadataExtractor :
     base_url = 'https://earthexplorer.usgs.gov/inventory/json/v/1.4.0/'
     page_num = 10
+    # api keys are cached by user and reused by all extractors until they expire
+    apikey_ttl = 3600
+    __apikeys = dict()
+    __apikeys_lock = threading.Lock()
+
+    def __init__(self, session=None, timeout=60) :
+        """
+        Args:
+            session (requests.Session): may be shared between extractors, see SessionFactory
+            timeout (float): request timeout in seconds
+        """
+        self.session = session if session is not None else SessionFactory.create()
+        self.timeout = timeout
 
     def __login (self,user,pwd) :
+        with USGSMetadataExtractor.__apikeys_lock :
+            cached = USGSMetadataExtractor.__apikeys.get(user)
+            if cached is not None and cached[1] > time.monotonic() :
+                self.apikey = cached[0]
+                return True
+
         json_body = {
                         "username": user,
                         "password": pwd,
@@ -189,7 +376,7 @@ class USGSMetadataExtractor :
                         "catalogId": "EE"}
        
         post_param = {"jsonRequest":json.dumps(json_body)}
-        r = requests.post(USGSMetadataExtractor.base_url + 'login',post_param)
+        r = self.session.post(USGSMetadataExtractor.base_url + 'login',post_param,timeout=self.timeout)
         if (r.status_code != 200) :
             print ('ERROR login: ' + str(r.status_code))
             return False
@@ -200,6 +387,9 @@ class USGSMetadataExtractor :
                 return False
             else :
                 self.apikey = r_body["data"]
+                with USGSMetadataExtractor.__apikeys_lock :
+                    USGSMetadataExtractor.__apikeys[user] = (self.apikey,
+                                                             time.monotonic() + USGSMetadataExtractor.apikey_ttl)
                 return True
         
     @staticmethod
@@ -209,21 +399,32 @@ class USGSMetadataExtractor :
         acqdate = datetime.datetime.strptime(raw_entity["acquisitionDate"],'%Y-%m-%d')
         platform = 'Landsat 8'
         tileid = productid[10:16]
+        cloudcover = float(raw_entity["cloudCover"]) if raw_entity.get("cloudCover") is not None else None
 
-        return MetadataEntity(platform,sceneid,productid,acqdate,tileid)
+        return MetadataEntity(platform,sceneid,productid,acqdate,tileid,cloudcover)
 
-    def retrieve_all (self, user, pwd, vector_file, stardate, enddate, cloud_max) :
-        if not self.__login(user,pwd) :
-            print ('ERROR: authorization failed')
+    def retrieve_all (self, user, pwd, vector_file, startdate, enddate, cloud_max) :
+        try :
+            return list(self.iter_all(user, pwd, vector_file, startdate, enddate, cloud_max))
+        except Exception as inst :
+            print (inst)
             return ''
 
+    def iter_all (self, user, pwd, vector_file, startdate, enddate, cloud_max) :
+        """
+        Queries USGS service and yields MetadataEntity records page by page.
+        Raises Exception if request fails.
+        """
+        if not self.__login(user,pwd) :
+            raise Exception('ERROR: authorization failed')
+
         if (vector_file is None):
-            print('ERROR: AOI isn\'t specified')
-            return ''
+            raise Exception('ERROR: AOI isn\'t specified')
 
         bbox = vop.BBOX.calc_BBOX_from_vector_file(vector_file)
 
-        if bbox.is_undefined() : return list()
+        if bbox.is_undefined() :
+            raise Exception('ERROR: can\'t calculate bbox of AOI: ' + vector_file)
 
         request_body = dict()
         request_body["datasetName"] = "LANDSAT_8_C1"
@@ -239,34 +440,29 @@ class USGSMetadataExtractor :
         request_body["maxCloudCover"] = cloud_max
 
         starting_number = 1
-        list_result = list()
         while True :
             request_body["startingNumber"] = starting_number
-            r = requests.post(USGSMetadataExtractor.base_url + 'search',
-                                {"jsonRequest":json.dumps(request_body)} )
+            r = self.session.post(USGSMetadataExtractor.base_url + 'search',
+                                  {"jsonRequest":json.dumps(request_body)}, timeout=self.timeout)
             if (r.status_code != 200) :
-                print ('ERROR search: ' + str(r.status_code))
-                return False
+                raise Exception('ERROR search: ' + str(r.status_code))
             else :
                 r_body = json.loads (r.text)
                 if (r_body["errorCode"]) :
-                    print ('ERROR search: ' + r_body["errorCode"])
-                    return False
+                    raise Exception('ERROR search: ' + r_body["errorCode"])
                 else :
                     if not "results" in r_body["data"] : break
                     for re in r_body["data"]["results"] :
-                        list_result.append(USGSMetadataExtractor.__convert_raw_entity(re))
+                        yield USGSMetadataExtractor.__convert_raw_entity(re)
                     starting_number+=USGSMetadataExtractor.page_num
                     if (starting_number>r_body["data"]["totalHits"]) : break
-                    
-        return list_result
 
 #################################################################################################
 # main:
 # 1. Parse input args
 # 2. Create MetadataExtractor (SciHubMetadataExtractor | USGSMetadataExtractor)
-# 3. Query metadata service and save it into in-memory list 
-# 4. Save in-memory list to disk as csv file
+# 3. Query metadata service, records are streamed page by page
+# 4. Write records to csv file as they arrive (and start downloads if -dl is set)
 #
 #################################################################################################
 
@@ -297,6 +493,30 @@ parser.add_argument('-o', required=True, metavar='output file',
 parser.add_argument('-a', help='Append to existing csv file', action='store_true')
 parser.add_argument('-prod', metavar='L2/L1', help='Product type')
 parser.add_argument('-t',metavar='tiles list', help='Tiles list comma separated')
+parser.add_argument('-rate', type=float, default=1.0, metavar='requests per second',
+                    help='Max rate of requests to SciHub, default 1')
+parser.add_argument('-w', type=int, default=4, metavar='workers',
+                    help='Number of parallel requests (tiles and pages) to SciHub, default 4')
+parser.add_argument('-timeout', type=float, default=60, metavar='seconds',
+                    help='Request timeout in seconds, default 60')
+parser.add_argument('-retries', type=int, default=3, metavar='retries',
+                    help='Number of retries of failed request, default 3')
+parser.add_argument('-catalog', metavar='catalog file',
+                    help='Local metadata catalog (sqlite), only date ranges not requested before '
+                         'are queried from remote service')
+parser.add_argument('-settle', type=int, default=7, metavar='days',
+                    help='Scenes of the last days may be published later, they are queried again '
+                         'on every run with -catalog, default 7')
+parser.add_argument('-grid', metavar='grid file',
+                    help='Tile grid vector file (S2 MGRS tiles or Landsat WRS-2 path/rows), '
+                         'only tiles intersecting AOI polygons (-b) are queried/kept')
+parser.add_argument('-gridfield', metavar='field name',
+                    help='Tile id field of grid file, default: Name for s2, PR for l8')
+parser.add_argument('-dl', metavar='download folder',
+                    help='Download found S2 L2A scenes from AWS into folder while query is still running '
+                         '(only with -sat s2 -prod L2)')
+parser.add_argument('-dlw', type=int, default=4, metavar='download workers',
+                    help='Number of scenes downloaded in parallel with -dl, default 4')
 
 
 if (len(sys.argv) == 1) :
@@ -304,6 +524,12 @@ if (len(sys.argv) == 1) :
     exit(0)
 args = parser.parse_args()
 
+if args.grid is not None and args.b is None :
+    print ('ERROR: -grid requires AOI vector file (-b)')
+    exit(1)
+if args.dl is not None and (args.sat != 's2' or args.prod is None or args.prod.upper() != 'L2') :
+    print ('ERROR: -dl is supported only for S2 L2A products: -sat s2 -prod L2')
+    exit(1)
 
 #args = parser.parse_args('-i /ext/Calculate/L2A/2018 -o /ext/Calculate/L4A/4tiles.txt -tids 39VVC 39UUB 39UVB 39VUC'.split(' '))
 
@@ -313,43 +539,162 @@ tiles = None
 if args.t is not None:
     tiles = args.t.split(',')
 
-list_metadata = list()
+# bbox of AOI may cover many tiles not touching its polygons, they are pruned by exact intersection
+grid_tiles = None
+if args.grid is not None :
+    grid = TileGrid(args.grid, args.gridfield if args.gridfield is not None else ('Name' if args.sat == 's2' else 'PR'))
+    grid_tiles = set(grid.tiles_for_vector_file(args.b))
+    print (str(len(grid_tiles)) + ' tiles intersect AOI')
+    if args.sat == 's2' :
+        tiles = sorted(grid_tiles) if tiles is None else [t for t in tiles if t in grid_tiles]
+
+catalog = MetadataCatalog(args.catalog) if args.catalog is not None else None
+vector_key = ''
+if args.b is not None :
+    with open(args.b, 'rb') as f :
+        vector_key = 'vector:' + hashlib.sha1(f.read()).hexdigest()
+
+
+def retrieve_cached (aoi, query, retrieve) :
+    """
+    Yields records of retrieve(startdate, enddate) (iterable of MetadataEntity)
+    requesting only date windows of aoi and query missing in catalog,
+    then yields the rest of catalog records for the whole period.
+    """
+    if catalog is None :
+        yield from retrieve(startdate, enddate)
+        return
+
+    # scenes of the last settle days may be not published yet (e.g. L2A products are processed
+    # with latency), so these days are never recorded as requested
+    last_covered = min(enddate.date(), datetime.date.today() - datetime.timedelta(days=args.settle + 1))
+    retrieved = set()
+    for gap_start, gap_end in catalog.gaps(aoi, query, args.cld, startdate.date(), enddate.date()) :
+        batch = list()
+        for e in retrieve(datetime.datetime.combine(gap_start, datetime.time()),
+                          datetime.datetime.combine(gap_end, datetime.time())) :
+            retrieved.add(e.sceneid)
+            batch.append(e)
+            yield e
+            if len(batch) == SciHubMetadataExtractor.page_num :
+                catalog.add_scenes(aoi, query, [e.get_row() for e in batch])
+                batch = list()
+        catalog.add_scenes(aoi, query, [e.get_row() for e in batch])
+        # window is recorded only if all its pages are received
+        if gap_start <= last_covered :
+            catalog.add_window(aoi, query, args.cld, gap_start, min(gap_end, last_covered))
+
+    for row in catalog.query(aoi, query, startdate.date(), enddate.date(), args.cld) :
+        if row[1] not in retrieved : yield MetadataEntity.from_row(row)
+
+
+query_failed = [False]
+
+
+def iter_reporting_errors (stream) :
+    """Stops stream on error keeping records received before it, script exits with code 1."""
+    try :
+        yield from stream
+    except Exception as inst :
+        print (inst)
+        query_failed[0] = True
+
+
+download_executor = None
+download_stats = collections.Counter()
+download_stats_lock = threading.Lock()
+if args.dl is not None :
+    # every scene worker runs up to 8 file transfers through one shared client
+    AWS_L2A.init(max_pool_connections=args.dlw * 8)
+    download_executor = ThreadPoolExecutor(max_workers=args.dlw)
+
+
+def download_scene (sceneid) :
+    try :
+        result = AWS_L2A.download_l2a_scene(sceneid, args.dl)
+    except Exception as inst :
+        print ('ERROR: downloading ' + sceneid + ': ' + str(inst), flush=True)
+        status = 'failed'
+    else :
+        if result.objects + result.skipped == 0 and len(result.failures) == 0 :
+            status = 'unavailable'
+        else :
+            status = 'success' if result else 'failed'
+    with download_stats_lock :
+        download_stats[status] += 1
+    print ('downloading ' + sceneid + ' ... ' + status, flush=True)
+
+
+def iter_starting_downloads (stream) :
+    """Submits download of every record to download_executor as soon as it's received."""
+    for e in stream :
+        download_executor.submit(download_scene, e.sceneid)
+        yield e
+
+
+def iter_counting (stream) :
+    for e in stream :
+        counter[0] += 1
+        yield e
+
+
+counter = [0]
+stream = list()
+# one session keeps alive connections for all requests
+session = SessionFactory.create(args.w * args.w, args.retries)
 
 if (args.sat == 's2') :
-    if tiles is None:
-        list_metadata = SciHubMetadataExtractor().retrieve_all(
+    # all tiles and pages share one rate limit
+    rate_limiter = RateLimiter(args.rate)
+    s2_query = 's2:' + (args.prod.lower() if args.prod is not None else '')
+
+    def retrieve_s2 (tiles, sd, ed) :
+        return SciHubMetadataExtractor(rate_limiter,args.w,session,args.timeout).iter_all(
                                                                 user=args.u,
                                                                 pwd=args.p,
                                                                 vector_file=args.b,
-                                                                startdate=startdate,
-                                                                enddate=enddate,
+                                                                startdate=sd,
+                                                                enddate=ed,
                                                                 cloud_max=args.cld,
                                                                 tiles=tiles,
                                                                 product=args.prod)
+
+    if tiles is None:
+        stream = iter_reporting_errors(retrieve_cached(vector_key, s2_query,
+                                                       lambda sd, ed: retrieve_s2(None, sd, ed)))
     else:
-        for tile in tiles:
-            print('quering ' + tile + ' ...', end = ' ')
-            list_metadata += SciHubMetadataExtractor().retrieve_all(
-                                                                user=args.u,
-                                                                pwd=args.p,
-                                                                vector_file=args.b,
-                                                                startdate=startdate,
-                                                                enddate=enddate,
-                                                                cloud_max=args.cld,
-                                                                tiles=[tile],
-                                                                product=args.prod)
-            time.sleep(5)
-            print ('done')
+        def retrieve_tile (tile) :
+            try :
+                yield from retrieve_cached('tile:' + tile + vector_key, s2_query,
+                                           lambda sd, ed: retrieve_s2([tile], sd, ed))
+            except Exception as inst :
+                raise Exception('tile ' + tile + ': ' + str(inst))
+            print('quering ' + tile + ' ... done')
+
+        # records of all tiles are merged in order of arrival, failed tiles are reported at the end
+        stream = iter_reporting_errors(MetadataOperations.merge_streams(
+            [lambda tile=tile: retrieve_tile(tile) for tile in tiles], args.w))
 
 else :
-    list_metadata = USGSMetadataExtractor().retrieve_all(args.u,
-                                                        args.p,
-                                                        args.b,
-                                                        startdate,
-                                                        enddate,
-                                                        args.cld)
-
-MetadataOperations.write_csv_file(list_metadata,args.o,args.a)
-
-
-print (args.sat + ': '  + str(len(list_metadata)))
\ No newline at end of file
+    stream = iter_reporting_errors(retrieve_cached(vector_key, 'l8',
+                                    lambda sd, ed: USGSMetadataExtractor(session,args.timeout).iter_all(args.u,
+                                                                                                            args.p,
+                                                                                                            args.b,
+                                                                                                            sd,
+                                                                                                            ed,
+                                                                                                            args.cld)))
+    if grid_tiles is not None :
+        stream = (e for e in stream if e.tileid in grid_tiles)
+
+stream = iter_counting(stream)
+if download_executor is not None :
+    stream = iter_starting_downloads(stream)
+MetadataOperations.write_csv_file(stream,args.o,args.a)
+
+
+if catalog is not None : catalog.close()
+print (args.sat + ': '  + str(counter[0]))
+if download_executor is not None :
+    download_executor.shutdown()
+    print ('downloaded: ' + ', '.join(k + ' ' + str(v) for k, v in sorted(download_stats.items())))
+if query_failed[0] : exit(1)
\ No newline at end of file
@@ -0,0 +1,138 @@
+import time
+import heapq
+import random
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, Future
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: delay before attempt n (n >= 1)
+    is random value in [0, min(max_delay, base_delay * 2**n)].
+    """
+
+    def __init__(self, max_attempts=5, base_delay=2.0, max_delay=300.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: grows by one per limit successful tasks (additive increase),
+    halves when server throttles (multiplicative decrease). A burst of throttled responses
+    halves limit once per cooldown seconds.
+    """
+
+    def __init__(self, max_limit, min_limit=1, cooldown=1.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.cooldown = cooldown
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.__last_decrease = 0
+
+    def can_start(self):
+        return self.in_flight < max(self.min_limit, int(self.limit))
+
+    def on_success(self):
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self.__last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self.__last_decrease = now
+
+
+class RetryScheduler:
+    """
+    Runs tasks in thread pool with per task retries. Failed task waits for its backoff delay
+    in a queue while other tasks keep running, number of concurrently running tasks
+    is controlled by AdaptiveLimiter, so throttling reduces concurrency instead of stopping all transfers.
+    """
+
+    def __init__(self, max_workers, policy=None, is_throttled=None, is_retryable=None):
+        """
+        Args:
+            policy: RetryPolicy
+            is_throttled: function(exception) -> bool, default is_http_throttled
+            is_retryable: function(exception) -> bool, by default all exceptions are retried
+        """
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.is_throttled = is_throttled if is_throttled is not None else RetryScheduler.is_http_throttled
+        self.is_retryable = is_retryable if is_retryable is not None else (lambda inst: True)
+        self.limiter = AdaptiveLimiter(max_workers)
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.__cond = threading.Condition()
+        self.__ready = collections.deque()
+        self.__delayed = list()
+        self.__seq = 0
+        self.__shutdown = False
+        self.__thread = threading.Thread(target=self.__loop, daemon=True)
+        self.__thread.start()
+
+    @staticmethod
+    def is_http_throttled(inst):
+        """Detects 429/503 responses of google api_core, requests and botocore exceptions."""
+        code = getattr(inst, 'code', None)
+        if code is None:
+            code = getattr(getattr(inst, 'response', None), 'status_code', None)
+        if code is None and isinstance(getattr(inst, 'response', None), dict):
+            code = inst.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return code in (429, 503) or str(inst)[0:3] in ('429', '503')
+
+    def submit(self, fn, *args):
+        """Schedules fn(*args), returns Future that is resolved after success or the last failed attempt."""
+        task = {'fn': fn, 'args': args, 'attempt': 0, 'future': Future()}
+        with self.__cond:
+            self.__ready.append(task)
+            self.__cond.notify()
+        return task['future']
+
+    def __loop(self):
+        with self.__cond:
+            while True:
+                now = time.monotonic()
+                while len(self.__delayed) > 0 and self.__delayed[0][0] <= now:
+                    self.__ready.append(heapq.heappop(self.__delayed)[2])
+                while len(self.__ready) > 0 and self.limiter.can_start():
+                    task = self.__ready.popleft()
+                    self.limiter.in_flight += 1
+                    self.__executor.submit(task['fn'], *task['args']).add_done_callback(
+                        lambda f, task=task: self.__on_done(task, f))
+                if (self.__shutdown and self.limiter.in_flight == 0
+                        and len(self.__ready) == 0 and len(self.__delayed) == 0):
+                    break
+                self.__cond.wait(self.__delayed[0][0] - now if len(self.__delayed) > 0 else None)
+
+    def __on_done(self, task, f):
+        with self.__cond:
+            self.limiter.in_flight -= 1
+            inst = f.exception()
+            if inst is None:
+                self.limiter.on_success()
+                task['future'].set_result(f.result())
+            else:
+                if self.is_throttled(inst):
+                    self.limiter.on_throttle()
+                task['attempt'] += 1
+                if task['attempt'] < self.policy.max_attempts and self.is_retryable(inst):
+                    self.__seq += 1
+                    heapq.heappush(self.__delayed, (time.monotonic() + self.policy.delay(task['attempt']),
+                                                    self.__seq, task))
+                else:
+                    task['future'].set_exception(inst)
+            self.__cond.notify()
+
+    def shutdown(self):
+        """Waits for all scheduled tasks including pending retries."""
+        with self.__cond:
+            self.__shutdown = True
+            self.__cond.notify()
+        self.__thread.join()
+        self.__executor.shutdown()
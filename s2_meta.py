@@ -1,4 +1,6 @@
 import os
+from downloader.scene_layout import SceneLayout
+from downloader.scene_converter import AWS2SciHubConverter
 
 BANDS = {
     'B01':60,'B02':10,'B03':10,'B04':10,'B05':20,'B06':20,
@@ -55,81 +57,13 @@ class L2AScene:
 
     @staticmethod
     def get_granule(scene_full_path):
-        for el in os.listdir(os.path.join(scene_full_path,'GRANULE')):
-            if el.startswith('L2A'):
-                return el
-        return None
+        return SceneLayout.get(scene_full_path)['granule']
 
     @staticmethod
     def aws2schihub(scene_full_path):
-        scene = os.path.basename(scene_full_path)
-
-        # metadata.xml -> MTD_MSIL2A.xml
-        os.rename(os.path.join(scene_full_path, 'metadata.xml'), os.path.join(scene_full_path, 'MTD_MSIL2A.xml'))
-        # productInfo.json isn't needed
-        os.remove(os.path.join(scene_full_path, 'productInfo.json'))
-
-        # it's rare but is possible that there are two version inside scene folder: "0" and "1"
-        # if it is the case then one of them is removed and the rest is converted
-        # by default there is only "0" version
-        # if subfolder "1" exists we've to decide
-        # which version of scene ("0" or "1") to delete.
-        # For that purpose we extract 'name' from 0/productInfo.json
-        # if extracted name equals scene then "0" is converted and "1" is deleted
-        # other way vice versa
-        sub_scene_path = os.path.join(scene_full_path, '0')
-        sub_scene_to_delete = None
-        if os.path.exists(os.path.join(scene_full_path, '1')):
-            product_info_file = open(os.path.join(sub_scene_path, 'productInfo.json'))
-            data = json.load(product_info_file)
-            if (data['name'] == scene):
-                sub_scene_to_delete = os.path.join(scene_full_path, '1')
-            else:
-                sub_scene_to_delete = sub_scene_path = os.path.join(scene_full_path, '0')
-                sub_scene_path = os.path.join(scene_full_path, '1')
-            product_info_file.close()
-        # delete second version of scene
-        if sub_scene_to_delete is not None:
-            shutil.rmtree(os.path.join(scene_full_path, sub_scene_to_delete))
-        # move all nested folders and files from
-        # sub scene folder (0 or 1) one level up to scene folder
-        for elem in os.listdir(sub_scene_path):
-            shutil.move(os.path.join(sub_scene_path, elem), scene_full_path)
-        shutil.rmtree(sub_scene_path)
-
-        # extract from metadata file granule name,
-        # creates sub folder GRANULE/{granule_name}
-        # and moves all raster bands and other files inside it
-        metadata_file = open(os.path.join(scene_full_path, 'MTD_MSIL2A.xml'), 'r')
-        metadata = metadata_file.read()
-        metadata_file.close()
-        granule_name = ''
-        m = re.search("GRANULE/([^/]*)/", metadata)
-        if m:
-            granule_name = m.group(1)
-
-        granule_path = os.path.join(scene_full_path, 'GRANULE')
-        os.mkdir(granule_path)
-        granule_path = os.path.join(granule_path, granule_name)
-        os.mkdir(granule_path)
-
-        shutil.move(os.path.join(scene_full_path, 'metadata.xml'), os.path.join(granule_path, 'MTD_TL.xml'))
-
-        granule_path = os.path.join(granule_path, 'IMG_DATA')
-        os.mkdir(granule_path)
-
-        shutil.move(os.path.join(scene_full_path, 'R10m'), granule_path)
-        shutil.move(os.path.join(scene_full_path, 'R20m'), granule_path)
-        shutil.move(os.path.join(scene_full_path, 'R60m'), granule_path)
-
-        # renames band files for different resolutions
-        prod_base = scene[38:44] + '_' + scene[11:26]
-        for (dirpath, dirnames, filenames) in os.walk(granule_path):
-            for f in filenames:
-                if (f.endswith('.jp2')):
-                    os.rename(os.path.join(dirpath, f),
-                              os.path.join(dirpath, prod_base + '_' + f.replace('.jp2', '_' + dirpath[-3:] + '.jp2')))
-
+        # conversion is planned and journaled, so interrupted conversion is completed by the next call,
+        # see AWS2SciHubConverter for batch and link based conversion
+        AWS2SciHubConverter.convert_scene(scene_full_path)
         return True
 
     @staticmethod
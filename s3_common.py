@@ -3,10 +3,61 @@ import sys
 import argparse
 import boto3
 import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class TransferResult:
+    """
+    Summary of a multi-object transfer: number of objects and bytes downloaded
+    and list of failed objects as (key, error message) pairs. Objects found complete
+    in transfer manifest are counted as skipped.
+    Evaluates to True if at least one object was downloaded or skipped and nothing failed.
+    """
+    def __init__(self):
+        self.objects = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.failures = list()
+        self.__lock = threading.Lock()
+
+    def add_success(self, key, size):
+        with self.__lock:
+            self.objects += 1
+            self.bytes += size
+
+    def add_skipped(self, key):
+        with self.__lock:
+            self.skipped += 1
+
+    def add_failure(self, key, error_msg):
+        with self.__lock:
+            self.failures.append((key, error_msg))
+
+    def merge(self, other):
+        """Adds up counters and failures of other TransferResult."""
+        with self.__lock:
+            self.objects += other.objects
+            self.bytes += other.bytes
+            self.skipped += other.skipped
+            self.failures.extend(other.failures)
+
+    def __bool__(self):
+        return self.objects + self.skipped > 0 and len(self.failures) == 0
+
+    def __repr__(self):
+        return (f'TransferResult(objects={self.objects}, bytes={self.bytes}, '
+                f'skipped={self.skipped}, failures={len(self.failures)})')
 
 
 
 class S3:
+    # buffer size for streaming object body to disk
+    chunk_size = 1024 * 1024
+    # objects of this size and bigger are downloaded by parallel ranged GETs
+    multipart_threshold = 64 * 1024 * 1024
+    part_size = 16 * 1024 * 1024
+
     @staticmethod
     def check_s3_path (s3_path) :
         if len(s3_path) == 0: return ''
@@ -14,67 +65,207 @@ class S3:
         else: return s3_path
 
     @staticmethod
-    def get_file_data(s3_client, bucket_name, key, req_pays=False):
+    def __get_object_kwargs(bucket_name, key, req_pays):
+        return ({'Bucket':bucket_name, 'Key':key, 'RequestPayer':'requester'} if req_pays
+                else {'Bucket':bucket_name, 'Key':key})
 
+    @staticmethod
+    def get_file_data(s3_client, bucket_name, key, req_pays=False):
+        """Returns whole object as bytes. Use download_file to save large objects to disk."""
         response = None
-        fun_kwargs = ({'Bucket':bucket_name, 'Key':key, 'RequestPayer':'requester'} if req_pays
-                      else {'Bucket':bucket_name, 'Key':key})
+        fun_kwargs = S3.__get_object_kwargs(bucket_name, key, req_pays)
         response = s3_client.get_object(**fun_kwargs)
 
         return response['Body'].read()
 
 
     @staticmethod
-    def download_file(s3_client,bucket_name,key,output_path,req_pays=False):
-        file_data = S3.get_file_data(s3_client,bucket_name,key,req_pays)
-        f = open(output_path, 'wb')
-        f.write(file_data)
-        f.close()
+    def __write_body(body, f, offset=None):
+        # copies streaming body to file through fixed size buffer,
+        # if offset is set then f is file descriptor and chunks are written with os.pwrite
+        size = 0
+        while True:
+            chunk = body.read(S3.chunk_size)
+            if not chunk: break
+            if offset is None:
+                f.write(chunk)
+            else:
+                os.pwrite(f, chunk, offset + size)
+            size += len(chunk)
+        body.close()
+        return size
 
 
+    @staticmethod
+    def __download_range(s3_client, bucket_name, key, fd, start, end, req_pays):
+        fun_kwargs = S3.__get_object_kwargs(bucket_name, key, req_pays)
+        fun_kwargs['Range'] = f'bytes={start}-{end}'
+        response = s3_client.get_object(**fun_kwargs)
+        size = S3.__write_body(response['Body'], fd, start)
+        if size != end - start + 1:
+            raise Exception(f'incomplete range {start}-{end}: {key}')
+        return size
 
-    def listsubfolders(s3_client, bucket_name, remote_dir, req_pays=False):
 
-        remote_dir = S3.check_s3_path(remote_dir)
+    @staticmethod
+    def download_file_ranged(s3_client, bucket_name, key, output_path, size, req_pays=False, max_connections=4):
+        """
+        Downloads object by parts of S3.part_size bytes: parts are requested by ranged GETs
+        in parallel and written into preallocated output file.
+        """
+        fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=max_connections) as executor:
+                futures = [executor.submit(S3.__download_range, s3_client, bucket_name, key, fd,
+                                           start, min(start + S3.part_size, size) - 1, req_pays)
+                           for start in range(0, size, S3.part_size)]
+                for future in futures:
+                    future.result()
+        except Exception:
+            os.close(fd)
+            os.remove(output_path)
+            raise
+        os.close(fd)
+
+
+    @staticmethod
+    def download_file(s3_client,bucket_name,key,output_path,req_pays=False,size=None,max_connections=1):
+        """
+        Streams object to output_path. If max_connections > 1 and object size
+        (requested by HEAD if not passed) exceeds S3.multipart_threshold
+        then object is downloaded by download_file_ranged.
+        """
+        if max_connections > 1:
+            if size is None:
+                size = s3_client.head_object(**S3.__get_object_kwargs(bucket_name, key, req_pays))['ContentLength']
+            if size >= S3.multipart_threshold:
+                S3.download_file_ranged(s3_client, bucket_name, key, output_path, size, req_pays, max_connections)
+                return
+
+        response = s3_client.get_object(**S3.__get_object_kwargs(bucket_name, key, req_pays))
+        with open(output_path, 'wb') as f:
+            S3.__write_body(response['Body'], f)
+
 
-        all_objects = None
-        fun_kwargs = {'Bucket':bucket_name, 'Delimiter':'/'}
+
+    @staticmethod
+    def __iter_pages(s3_client, bucket_name, remote_dir, req_pays, delimiter=None):
+        fun_kwargs = {'Bucket':bucket_name}
+        if delimiter is not None: fun_kwargs['Delimiter'] = delimiter
         if req_pays: fun_kwargs['RequestPayer'] = 'requester'
         if remote_dir != '' and remote_dir is not None: fun_kwargs['Prefix'] = remote_dir
 
-        objects = s3_client.list_objects(**fun_kwargs)
-        subfolders = list()
-        for o in objects.get('CommonPrefixes'):
-            subfolders.append(o.get('Prefix')[len(remote_dir):-1])
+        paginator = s3_client.get_paginator('list_objects_v2')
+        return paginator.paginate(**fun_kwargs)
+
 
-        return subfolders
+    @staticmethod
+    def iter_objects(s3_client, bucket_name, remote_dir, req_pays=False):
+        """
+        Lazily lists all objects under remote_dir. Yields object descriptions (dicts with 'Key', 'Size',
+        'ETag' ...) page by page, next page is requested only when previous one is consumed.
+        """
+        for page in S3.__iter_pages(s3_client, bucket_name, S3.check_s3_path(remote_dir), req_pays):
+            for obj in page.get('Contents', []):
+                yield obj
 
 
+    @staticmethod
+    def iter_subfolders(s3_client, bucket_name, remote_dir, req_pays=False):
+        """Lazily lists names of direct subfolders of remote_dir."""
+        remote_dir = S3.check_s3_path(remote_dir)
+        for page in S3.__iter_pages(s3_client, bucket_name, remote_dir, req_pays, '/'):
+            for o in page.get('CommonPrefixes', []):
+                yield o.get('Prefix')[len(remote_dir):-1]
 
 
     @staticmethod
-    def download_dir_recursive(s3_client,bucket_name,remote_dir,local_dir,req_pays=False):
-        if remote_dir is None or len(remote_dir) == 0: return  False
-        else: remote_dir = S3.check_s3_path(remote_dir)
+    def listsubfolders(s3_client, bucket_name, remote_dir, req_pays=False):
+        return list(S3.iter_subfolders(s3_client, bucket_name, remote_dir, req_pays))
+
+
+    @staticmethod
+    def get_manifest_key(bucket_name, key):
+        return f's3://{bucket_name}/{key}'
+
 
+    @staticmethod
+    def __download_object(s3_client, bucket_name, obj, output_path, req_pays, max_connections, manifest):
+        loc_path = os.path.dirname(output_path)
+        if not os.path.exists(loc_path):
+            pathlib.Path(loc_path).mkdir(parents=True, exist_ok=True)
+        if manifest is not None:
+            manifest.start(S3.get_manifest_key(bucket_name, obj['Key']), obj['Size'], obj['ETag'])
+        S3.download_file(s3_client, bucket_name, obj['Key'], output_path, req_pays, obj['Size'], max_connections)
+        size = os.path.getsize(output_path)
+        if size != obj['Size']:
+            raise Exception(f'size mismatch {size} != {obj["Size"]}: {obj["Key"]}')
+        if manifest is not None:
+            manifest.complete(S3.get_manifest_key(bucket_name, obj['Key']))
+        return size
 
-        fun_kwargs = ({'Bucket': bucket_name, 'Prefix' : remote_dir, 'RequestPayer' : 'requester'} if req_pays
-                        else {'Bucket': bucket_name, 'Prefix' : remote_dir})
 
-        all_objects = s3_client.list_objects(**fun_kwargs)
-        if 'Contents' not in all_objects.keys(): return False
-        remote_dir = os.path.dirname(remote_dir[:-1])
-        for obj in all_objects['Contents']:
-            filename = os.path.basename(obj['Key'])
-            rel_path = os.path.dirname(obj['Key'])[len(remote_dir) + 1:]
+    @staticmethod
+    def download_prefix(s3_client, bucket_name, remote_dir, local_dir, req_pays=False, max_workers=8,
+                        max_connections=1, manifest=None):
+        """
+        Downloads all objects under remote_dir into local_dir preserving nested structure
+        (same as "aws s3 cp --recursive"). Up to max_workers objects are transferred at a time,
+        errors are collected per object and don't stop the rest of transfers.
+        Large objects are downloaded by max_connections ranged GETs (see download_file).
+        If manifest (TransferManifest) is passed then objects already downloaded with
+        the same size and ETag are skipped and all transfers are recorded in it.
 
-            loc_path = os.path.join(local_dir,rel_path)
-            if not os.path.exists(loc_path):
-                pathlib.Path(loc_path).mkdir(parents=True, exist_ok=True)
+        Returns:
+            TransferResult
+        """
+        result = TransferResult()
+        remote_dir = S3.check_s3_path(remote_dir)
 
-            S3.download_file(s3_client,bucket_name,obj['Key'],os.path.join(loc_path,filename),req_pays)
+        # objects are submitted while listing goes on, number of pending transfers
+        # is limited so that memory doesn't depend on number of listed objects
+        max_pending = 2 * max_workers
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict()
+            for obj in S3.iter_objects(s3_client, bucket_name, remote_dir, req_pays):
+                # skip zero size "folder" objects
+                if obj['Key'].endswith('/'): continue
+                if len(futures) >= max_pending:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    S3.__collect_results(futures, done, result)
+                output_path = os.path.join(local_dir, obj['Key'][len(remote_dir):])
+                if manifest is not None and manifest.is_complete(S3.get_manifest_key(bucket_name, obj['Key']),
+                                                                 obj['Size'], obj['ETag'], output_path):
+                    result.add_skipped(obj['Key'])
+                    continue
+                futures[executor.submit(S3.__download_object, s3_client, bucket_name, obj,
+                                        output_path, req_pays, max_connections, manifest)] = obj['Key']
+            S3.__collect_results(futures, list(futures), result)
 
-        return True
+        return result
 
 
+    @staticmethod
+    def __collect_results(futures, done, result):
+        for future in done:
+            key = futures.pop(future)
+            try:
+                result.add_success(key, future.result())
+            except Exception as inst:
+                result.add_failure(key, str(inst))
+
+
+    @staticmethod
+    def download_dir_recursive(s3_client,bucket_name,remote_dir,local_dir,req_pays=False,max_workers=8,
+                               max_connections=1, manifest=None):
+        """
+        Downloads remote_dir into local_dir: last folder of remote_dir
+        becomes subfolder of local_dir. See download_prefix.
+        """
+        if remote_dir is None or len(remote_dir) == 0: return  False
+        else: remote_dir = S3.check_s3_path(remote_dir)
 
+        return S3.download_prefix(s3_client, bucket_name, remote_dir,
+                                  os.path.join(local_dir, os.path.basename(remote_dir[:-1])),
+                                  req_pays, max_workers, max_connections, manifest)
@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from downloader.scene_layout import SceneLayout
+
+
+class AWS2SciHubConverter:
+    """
+    Converts S2 L2A scene folders downloaded from AWS (AWS_L2A.download_l2a_scene)
+    into Sci-HUB (SAFE) layout, see s2_meta.L2AScene.aws2schihub.
+
+    Conversion of scene is planned first (all directories and file renames are computed
+    without changing anything), the plan is saved into journal file inside target scene folder,
+    then operations are applied one by one and marked in journal. If conversion is interrupted,
+    the next run finds journal and completes the plan. Every operation can be safely repeated,
+    so plan may be replayed from any operation, e.g. if progress marks are lost by OS crash.
+
+    Modes:
+        move - scene folder is converted in place by renames
+        hardlink, symlink - Sci-HUB layout is built in output folder by links to files
+                            of source scene folder, source folder isn't changed
+    """
+    journal_name = '.aws2scihub_journal'
+    MODES = ['move', 'hardlink', 'symlink']
+
+    @staticmethod
+    def __get_granule_name(metadata_file):
+        with open(metadata_file, 'r') as f:
+            m = re.search('GRANULE/([^/]*)/', f.read())
+        return m.group(1) if m else ''
+
+    @staticmethod
+    def plan(scene_full_path, mode='move', output_scene_path=None):
+        """
+        Returns list of operations (lists [name, args...]) converting scene:
+            ['mkdir', path], ['rename', src, dst], ['rmtree', path],
+            ['hardlink', src, dst], ['symlink', src, dst]
+        """
+        scene = os.path.basename(os.path.normpath(scene_full_path))
+        dest = scene_full_path if mode == 'move' else output_scene_path
+        # it's rare but is possible that there are two versions inside scene folder: "0" and "1",
+        # only proper one is converted (see SceneLayout)
+        tile_version = str(SceneLayout.get(scene_full_path)['tile_version'])
+        sub_scene_path = os.path.join(scene_full_path, tile_version)
+        granule_path = os.path.join(dest, 'GRANULE',
+                                    AWS2SciHubConverter.__get_granule_name(os.path.join(scene_full_path,
+                                                                                        'metadata.xml')))
+        img_data_path = os.path.join(granule_path, 'IMG_DATA')
+        prod_base = scene[38:44] + '_' + scene[11:26]
+
+        # (src, dst) of all files of new layout
+        files = [(os.path.join(scene_full_path, 'metadata.xml'), os.path.join(dest, 'MTD_MSIL2A.xml'))]
+        for dirpath, dirnames, filenames in os.walk(sub_scene_path):
+            rel_dir = os.path.relpath(dirpath, sub_scene_path)
+            top = rel_dir.split(os.sep)[0]
+            for f in filenames:
+                if rel_dir == '.' and f == 'metadata.xml':
+                    dst = os.path.join(granule_path, 'MTD_TL.xml')
+                elif top in ('R10m', 'R20m', 'R60m'):
+                    # B04.jp2 -> T40UFB_20200501T065631_B04_10m.jp2
+                    name = prod_base + '_' + f.replace('.jp2', '_' + dirpath[-3:] + '.jp2') \
+                        if f.endswith('.jp2') else f
+                    dst = os.path.join(img_data_path, rel_dir, name)
+                else:
+                    dst = os.path.join(dest, rel_dir, f)
+                files.append((os.path.join(dirpath, f), os.path.normpath(dst)))
+
+        # productInfo.json of sub scene replaces productInfo.json of scene (rename replaces existing file)
+        ops = list()
+        dirs = sorted(set(os.path.dirname(dst) for src, dst in files) | {img_data_path})
+        ops += [['mkdir', d] for d in dirs]
+        ops += [['rename' if mode == 'move' else mode, src, dst] for src, dst in files]
+        if mode == 'move':
+            for version in ('0', '1'):
+                if os.path.exists(os.path.join(scene_full_path, version)):
+                    ops.append(['rmtree', os.path.join(scene_full_path, version)])
+        return ops
+
+    @staticmethod
+    def __apply(op):
+        name = op[0]
+        if name == 'mkdir':
+            os.makedirs(op[1], exist_ok=True)
+        elif name == 'rmtree':
+            if os.path.exists(op[1]): shutil.rmtree(op[1])
+        # repeated rename/link after crash: source is already moved or link exists
+        elif name == 'rename':
+            if os.path.exists(op[1]) or not os.path.exists(op[2]): os.replace(op[1], op[2])
+        elif name == 'hardlink':
+            if not os.path.exists(op[2]): os.link(op[1], op[2])
+        elif name == 'symlink':
+            if not os.path.lexists(op[2]): os.symlink(os.path.abspath(op[1]), op[2])
+        else:
+            raise Exception('ERROR: unknown operation ' + name)
+
+    @staticmethod
+    def __fsync_dir(path):
+        # renames are persisted by fsync of directory (not supported on Windows)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def __read_journal(journal_file):
+        """Returns (ops, number of applied ops) or None if journal isn't complete."""
+        with open(journal_file) as f:
+            lines = f.read().splitlines()
+        try:
+            return json.loads(lines[0]), len(lines) - 1
+        except (IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def convert_scene(scene_full_path, mode='move', output_folder=None):
+        """
+        Converts scene folder, interrupted conversion is completed.
+
+        Returns:
+            'converted', 'recovered' or 'skipped' (scene is already converted)
+        """
+        scene_full_path = os.path.normpath(scene_full_path)
+        if mode not in AWS2SciHubConverter.MODES:
+            raise Exception('ERROR: unknown mode ' + mode)
+        if mode != 'move' and output_folder is None:
+            raise Exception('ERROR: output folder is required for ' + mode + ' mode')
+        scene = os.path.basename(scene_full_path)
+        target = scene_full_path if mode == 'move' else os.path.join(output_folder, scene)
+        journal_file = os.path.join(target, AWS2SciHubConverter.journal_name)
+
+        journal = AWS2SciHubConverter.__read_journal(journal_file) if os.path.exists(journal_file) else None
+        if journal is not None:
+            status = 'recovered'
+            ops, applied = journal
+        else:
+            # journal without complete plan is written before any change, so it's safe to plan again
+            if os.path.exists(journal_file): os.remove(journal_file)
+            if os.path.exists(os.path.join(target, 'MTD_MSIL2A.xml')):
+                return 'skipped'
+            status = 'converted'
+            ops, applied = AWS2SciHubConverter.plan(scene_full_path, mode, target), 0
+            os.makedirs(target, exist_ok=True)
+            with open(journal_file, 'w') as f:
+                f.write(json.dumps(ops) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+        with open(journal_file, 'a') as f:
+            for i in range(applied, len(ops)):
+                if ops[i][0] == 'rmtree':
+                    # files moved out of removed folder must be on disk before it's removed
+                    for d in sorted(set(os.path.dirname(op[2]) for op in ops if op[0] == 'rename')):
+                        AWS2SciHubConverter.__fsync_dir(d)
+                AWS2SciHubConverter.__apply(ops[i])
+                f.write(str(i) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        os.remove(journal_file)
+        return status
+
+    @staticmethod
+    def try_convert_scene(scene_full_path, mode='move', output_folder=None):
+        """Same as convert_scene, returns dict (scene, status, error_msg) instead of raising exception."""
+        try:
+            return {'scene': os.path.basename(scene_full_path),
+                    'status': AWS2SciHubConverter.convert_scene(scene_full_path, mode, output_folder)}
+        except Exception as inst:
+            return {'scene': os.path.basename(scene_full_path), 'status': 'failed', 'error_msg': str(inst)}
+
+    @staticmethod
+    def convert_all(scenes_folder, mode='move', output_folder=None, max_workers=8, use_processes=False):
+        """
+        Converts all L2A scene folders (S2?_MSIL2A_*) of scenes_folder in parallel by threads
+        or processes. Yields dicts (scene, status, error_msg) as scenes are finished.
+        """
+        scenes = [os.path.join(scenes_folder, el) for el in sorted(os.listdir(scenes_folder))
+                  if el.startswith('S2') and el[4:10] == 'MSIL2A'
+                  and os.path.isdir(os.path.join(scenes_folder, el))]
+        pool = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool(max_workers=max_workers) as executor:
+            futures = [executor.submit(AWS2SciHubConverter.try_convert_scene, scene, mode, output_folder)
+                       for scene in scenes]
+            for future in as_completed(futures):
+                yield future.result()
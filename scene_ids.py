@@ -0,0 +1,159 @@
+import datetime
+import functools
+import collections
+import numpy as np
+
+
+S2ParsedID = collections.namedtuple('S2ParsedID',
+                                    'sceneid platform level datetime baseline orbit tile version')
+LandsatParsedID = collections.namedtuple('LandsatParsedID',
+                                         'sceneid sensor level path row pathrow date processing_date '
+                                         'collection tier')
+
+
+def _digits_to_int(chars, start, end):
+    # chars: uint8 array (n, id length), converts ASCII digits chars[:, start:end] to int64 numbers
+    digits = chars[:, start:end].astype(np.int64) - ord('0')
+    return digits @ (10 ** np.arange(end - start - 1, -1, -1, dtype=np.int64))
+
+
+def _string_column(chars, start, end):
+    return np.ascontiguousarray(chars[:, start:end]).view(f'S{end - start}').ravel()
+
+
+def _is_valid(chars, separators, digits):
+    """Checks that all chars at separators positions are '_' and at digits positions are digits."""
+    digits_mask = np.zeros(chars.shape[1], dtype=bool)
+    digits_mask[digits] = True
+    # chars below '0' wrap around to big numbers
+    valid = np.all(((chars - np.uint8(ord('0'))) < 10) | ~digits_mask, axis=1)
+    return valid & np.all(chars[:, separators] == ord('_'), axis=1)
+
+
+def _days_from_civil(year, month, day):
+    # number of days since 1970-01-01 of proleptic Gregorian date (H. Hinnant's algorithm)
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    return era * 146097 + year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year - 719468
+
+
+def _to_datetime64(chars, date_start, time_start=None):
+    """Converts yyyymmdd (and optional hhmmss) fields into datetime64[s] (or datetime64[D] without time)."""
+    ymd = _digits_to_int(chars, date_start, date_start + 8)
+    days = _days_from_civil(ymd // 10000, ymd // 100 % 100, ymd % 100)
+    if time_start is None:
+        return days.astype('datetime64[D]')
+    hms = _digits_to_int(chars, time_start, time_start + 6)
+    return (days * 86400 + hms // 10000 * 3600 + hms // 100 % 100 * 60 + hms % 100).astype('datetime64[s]')
+
+
+def _to_chars(sceneids, length):
+    """
+    Returns uint8 array (number of ids, length) of ASCII codes of ids.
+    Ids longer than length (e.g. with .SAFE suffix) are truncated, shorter are padded by zero bytes.
+    """
+    sceneids = np.asarray(sceneids)
+    if sceneids.dtype.kind == 'U':
+        # unicode array is array of 4 byte code points
+        return sceneids.astype(f'U{length}').view(np.uint32).reshape(-1, length).astype(np.uint8)
+    return np.ascontiguousarray(sceneids.astype(f'S{length}')).view(np.uint8).reshape(-1, length)
+
+
+class S2SceneIDs:
+    """
+    Parsing of Sentinel 2 product ids (S2B_MSIL2A_20191109T081049_N0213_R078_T37TGK_20191109T101247):
+    parse - vectorized parsing of array of ids into structured array,
+    get - cached parsing of single id into immutable S2ParsedID.
+    version is product discriminator (generation time), baseline is processing baseline (N0213 -> 213).
+    """
+    LENGTH = 60
+    DTYPE = np.dtype([('platform', 'S3'), ('level', 'S6'), ('datetime', 'datetime64[s]'), ('baseline', 'i2'),
+                      ('orbit', 'i2'), ('tile', 'S5'), ('version', 'datetime64[s]'), ('valid', '?')])
+    SEPARATORS = [3, 10, 26, 32, 37, 44]
+    DIGITS = list(range(11, 19)) + list(range(20, 26)) + list(range(28, 32)) + list(range(34, 37)) + \
+             list(range(45, 53)) + list(range(54, 60))
+
+    @staticmethod
+    def parse(sceneids):
+        """Returns structured array of DTYPE, datetime and version of not valid ids are NaT."""
+        chars = _to_chars(sceneids, S2SceneIDs.LENGTH)
+        result = np.empty(len(chars), dtype=S2SceneIDs.DTYPE)
+        result['valid'] = _is_valid(chars, S2SceneIDs.SEPARATORS, S2SceneIDs.DIGITS)
+        result['platform'] = _string_column(chars, 0, 3)
+        result['level'] = _string_column(chars, 4, 10)
+        result['datetime'] = _to_datetime64(chars, 11, 20)
+        result['baseline'] = _digits_to_int(chars, 28, 32)
+        result['orbit'] = _digits_to_int(chars, 34, 37)
+        result['tile'] = _string_column(chars, 39, 44)
+        result['version'] = _to_datetime64(chars, 45, 54)
+        result['datetime'][~result['valid']] = np.datetime64('NaT')
+        result['version'][~result['valid']] = np.datetime64('NaT')
+        return result
+
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def get(sceneid):
+        return S2ParsedID(sceneid=sceneid,
+                          platform=sceneid[0:3],
+                          level=sceneid[4:10],
+                          datetime=datetime.datetime(int(sceneid[11:15]), int(sceneid[15:17]), int(sceneid[17:19]),
+                                                     int(sceneid[20:22]), int(sceneid[22:24]), int(sceneid[24:26])),
+                          baseline=int(sceneid[28:32]),
+                          orbit=int(sceneid[34:37]),
+                          tile=sceneid[39:44],
+                          version=datetime.datetime(int(sceneid[45:49]), int(sceneid[49:51]), int(sceneid[51:53]),
+                                                    int(sceneid[54:56]), int(sceneid[56:58]), int(sceneid[58:60])))
+
+
+class LandsatSceneIDs:
+    """
+    Parsing of Landsat product ids (LC08_L2SP_166025_20161227_20200905_02_T2), see S2SceneIDs.
+    """
+    LENGTH = 40
+    DTYPE = np.dtype([('sensor', 'S4'), ('level', 'S4'), ('path', 'i2'), ('row', 'i2'), ('pathrow', 'S6'),
+                      ('date', 'datetime64[D]'), ('processing_date', 'datetime64[D]'), ('collection', 'i1'),
+                      ('tier', 'S2'), ('valid', '?')])
+    SEPARATORS = [4, 9, 16, 25, 34, 37]
+    DIGITS = list(range(10, 16)) + list(range(17, 25)) + list(range(26, 34)) + list(range(35, 37))
+    TIERS = [b'RT', b'T1', b'T2']
+
+    @staticmethod
+    def parse(sceneids):
+        """Returns structured array of DTYPE, dates of not valid ids are NaT."""
+        # one extra char to check that ids aren't longer than LENGTH
+        chars = _to_chars(sceneids, LandsatSceneIDs.LENGTH + 1)
+        too_long = chars[:, LandsatSceneIDs.LENGTH] != 0
+        chars = chars[:, :LandsatSceneIDs.LENGTH]
+        result = np.empty(len(chars), dtype=LandsatSceneIDs.DTYPE)
+        # tier is the last field, so truncated ids (e.g. ..._T) pass separators and digits check
+        result['valid'] = _is_valid(chars, LandsatSceneIDs.SEPARATORS, LandsatSceneIDs.DIGITS) & ~too_long & \
+                          np.isin(_string_column(chars, 38, 40), LandsatSceneIDs.TIERS)
+        result['sensor'] = _string_column(chars, 0, 4)
+        result['level'] = _string_column(chars, 5, 9)
+        result['path'] = _digits_to_int(chars, 10, 13)
+        result['row'] = _digits_to_int(chars, 13, 16)
+        result['pathrow'] = _string_column(chars, 10, 16)
+        result['date'] = _to_datetime64(chars, 17)
+        result['processing_date'] = _to_datetime64(chars, 26)
+        result['collection'] = _digits_to_int(chars, 35, 37)
+        result['tier'] = _string_column(chars, 38, 40)
+        result['date'][~result['valid']] = np.datetime64('NaT')
+        result['processing_date'][~result['valid']] = np.datetime64('NaT')
+        return result
+
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def get(sceneid):
+        return LandsatParsedID(sceneid=sceneid,
+                               sensor=sceneid[0:4],
+                               level=sceneid[5:9],
+                               path=int(sceneid[10:13]),
+                               row=int(sceneid[13:16]),
+                               pathrow=sceneid[10:16],
+                               date=datetime.date(int(sceneid[17:21]), int(sceneid[21:23]), int(sceneid[23:25])),
+                               processing_date=datetime.date(int(sceneid[26:30]), int(sceneid[30:32]),
+                                                             int(sceneid[32:34])),
+                               collection=int(sceneid[35:37]),
+                               tier=sceneid[38:40])
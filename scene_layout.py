@@ -0,0 +1,94 @@
+import os
+import json
+import threading
+
+
+class SceneLayout:
+    """
+    Memoized layout of local S2 L2A scene folders: granule name (GRANULE/L2A_...)
+    and proper tile version (subfolder "0" or "1" of AWS format, see S2.L2AScene).
+    Folder is scanned once, then layout is taken from memory while modification times
+    of scene folder and its GRANULE subfolder are unchanged.
+    With use_sidecar layout is also saved into scene folder (sidecar_name file),
+    so other processes don't scan folder and parse productInfo.json again.
+    """
+    sidecar_name = '.scene_layout.json'
+    use_sidecar = False
+    __cache = dict()
+    __lock = threading.Lock()
+
+    @staticmethod
+    def __get_mtimes(scene_full_path):
+        try:
+            granule_mtime = os.stat(os.path.join(scene_full_path, 'GRANULE')).st_mtime_ns
+        except OSError:
+            granule_mtime = None
+        return [os.stat(scene_full_path).st_mtime_ns, granule_mtime]
+
+    @staticmethod
+    def __scan(scene_full_path):
+        granule = None
+        granule_path = os.path.join(scene_full_path, 'GRANULE')
+        if os.path.isdir(granule_path):
+            granule = next((el for el in os.listdir(granule_path) if el.startswith('L2A')), None)
+
+        # if there are two versions "0" and "1" proper one is defined by name from 0/productInfo.json
+        tile_version = 0
+        if os.path.exists(os.path.join(scene_full_path, '1')):
+            with open(os.path.join(scene_full_path, '0', 'productInfo.json')) as f:
+                tile_version = 0 if json.load(f)['name'] == os.path.basename(scene_full_path) else 1
+        return {'granule': granule, 'tile_version': tile_version}
+
+    @staticmethod
+    def __read_sidecar(scene_full_path, mtimes):
+        try:
+            with open(os.path.join(scene_full_path, SceneLayout.sidecar_name)) as f:
+                layout = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return layout if layout.get('mtimes') == mtimes else None
+
+    @staticmethod
+    def __write_sidecar(scene_full_path, layout):
+        sidecar = os.path.join(scene_full_path, SceneLayout.sidecar_name)
+        try:
+            created = not os.path.exists(sidecar)
+            with open(sidecar, 'w') as f:
+                json.dump(layout, f)
+            # new file changes folder mtime, rewriting existing file doesn't
+            if created:
+                layout['mtimes'] = SceneLayout.__get_mtimes(scene_full_path)
+                with open(sidecar, 'w') as f:
+                    json.dump(layout, f)
+        except OSError:
+            pass
+
+    @staticmethod
+    def get(scene_full_path):
+        """
+        Returns dict with granule (None if there is no GRANULE folder) and tile_version of scene folder.
+        Missing scene folder has tile_version 0 and no granule, layout isn't cached.
+        """
+        scene_full_path = os.path.normpath(scene_full_path)
+        if not os.path.isdir(scene_full_path):
+            return {'granule': None, 'tile_version': 0}
+        mtimes = SceneLayout.__get_mtimes(scene_full_path)
+        with SceneLayout.__lock:
+            layout = SceneLayout.__cache.get(scene_full_path)
+        if layout is not None and layout['mtimes'] == mtimes:
+            return layout
+
+        layout = SceneLayout.__read_sidecar(scene_full_path, mtimes) if SceneLayout.use_sidecar else None
+        if layout is None:
+            layout = SceneLayout.__scan(scene_full_path)
+            layout['mtimes'] = mtimes
+            if SceneLayout.use_sidecar:
+                SceneLayout.__write_sidecar(scene_full_path, layout)
+        with SceneLayout.__lock:
+            SceneLayout.__cache[scene_full_path] = layout
+        return layout
+
+    @staticmethod
+    def clear():
+        with SceneLayout.__lock:
+            SceneLayout.__cache.clear()
@@ -0,0 +1,92 @@
+import numpy as np
+from osgeo import gdal
+
+
+class SRTransform:
+    """
+    Conversion of raw band values into surface reflectance: raw * scale + offset,
+    optionally clipped into [clip_min, clip_max].
+    """
+    DTYPES = [np.dtype(np.float32), np.dtype(np.int16)]
+
+    @staticmethod
+    def check_dtype(dtype):
+        """Returns np.dtype of dtype given as type or name ('int16'), only float32 and int16 are supported."""
+        dtype = np.dtype(dtype)
+        if dtype not in SRTransform.DTYPES:
+            raise Exception('ERROR: SR dtype must be float32 or int16, not ' + str(dtype))
+        return dtype
+
+    def __init__(self, scale, offset=0.0, clip_min=None, clip_max=None):
+        self.scale = scale
+        self.offset = offset
+        self.clip_min = clip_min
+        self.clip_max = clip_max
+
+    def apply(self, values, dtype=np.float32, int16_scale=10000):
+        """
+        Transforms float array values in place and returns it, with dtype=np.int16
+        returns new array of SR * int16_scale rounded to integers.
+        """
+        dtype = SRTransform.check_dtype(dtype)
+        values *= self.scale
+        if self.offset != 0: values += self.offset
+        if self.clip_min is not None or self.clip_max is not None:
+            np.clip(values, self.clip_min, self.clip_max, out=values)
+        if dtype == np.int16:
+            values *= int16_scale
+            np.rint(values, out=values)
+            np.clip(values, np.iinfo(np.int16).min, np.iinfo(np.int16).max, out=values)
+            return values.astype(np.int16)
+        return values
+
+
+class SRReader:
+    """
+    Reads band raster by blocks of rows and yields surface reflectance blocks.
+    Raw values are read by GDAL directly into float32 buffer, transform is applied in place,
+    so memory is limited by block size (block_rows * raster width pixels) instead of the whole raster
+    with float64 temporaries.
+    """
+    block_rows = 1024
+
+    @staticmethod
+    def __open(band_file):
+        ds = gdal.Open(band_file)
+        if ds is None:
+            raise Exception('ERROR: can\'t open raster file: ' + band_file)
+        return ds
+
+    @staticmethod
+    def iter_blocks(band_file, transform, dtype=np.float32, window=None, band_num=1):
+        """
+        Args:
+            transform: SRTransform
+            dtype: np.float32 or np.int16 (SR * 10000)
+            window: pixel window (col_off, row_off, width, height), default - whole raster
+
+        Yields:
+            (row offset inside window, SR block)
+        """
+        dtype = SRTransform.check_dtype(dtype)
+        ds = SRReader.__open(band_file)
+        band = ds.GetRasterBand(band_num)
+        col_off, row_off, width, height = window if window is not None else (0, 0, ds.RasterXSize, ds.RasterYSize)
+        block_height = band.GetBlockSize()[1]
+        rows = max(block_height, SRReader.block_rows // block_height * block_height)
+        for block_row in range(0, height, rows):
+            values = band.ReadAsArray(col_off, row_off + block_row, width, min(rows, height - block_row),
+                                      buf_type=gdal.GDT_Float32)
+            yield block_row, transform.apply(values, dtype)
+
+    @staticmethod
+    def read(band_file, transform, dtype=np.float32, window=None, band_num=1):
+        """Returns SR array of window (whole raster by default) filled block by block."""
+        dtype = SRTransform.check_dtype(dtype)
+        if window is None:
+            ds = SRReader.__open(band_file)
+            window = (0, 0, ds.RasterXSize, ds.RasterYSize)
+        result = np.empty((window[3], window[2]), dtype=dtype)
+        for block_row, block in SRReader.iter_blocks(band_file, transform, dtype, window, band_num):
+            result[block_row:block_row + block.shape[0]] = block
+        return result
@@ -0,0 +1,13 @@
+import os
+import sys
+import importlib.util
+
+# modules import each other as "downloader" package, repository folder is registered
+# under this name, so tests run from checkout folder with any name
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if 'downloader' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('downloader', os.path.join(root, '__init__.py'),
+                                                  submodule_search_locations=[root])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['downloader'] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,90 @@
+import struct
+import numpy as np
+import pytest
+from downloader.cog_reader import COGReader
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.status_code = 206
+        self.content = content
+
+
+class FakeSession:
+    """Serves byte ranges of in-memory file, records timeouts of requests."""
+
+    def __init__(self, data):
+        self.data = data
+        self.timeouts = list()
+
+    def get(self, url, headers=None, timeout=None):
+        self.timeouts.append(timeout)
+        start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+        return FakeResponse(self.data[start:end + 1])
+
+
+def make_tiled_tiff(image, tile_size):
+    """Uncompressed little-endian tiled TIFF of uint16 image."""
+    height, width = image.shape
+    tiles_across = (width + tile_size - 1) // tile_size
+    tiles_down = (height + tile_size - 1) // tile_size
+    tiles = list()
+    for r in range(tiles_down):
+        for c in range(tiles_across):
+            tile = np.zeros((tile_size, tile_size), dtype='<u2')
+            part = image[r * tile_size:(r + 1) * tile_size, c * tile_size:(c + 1) * tile_size]
+            tile[:part.shape[0], :part.shape[1]] = part
+            tiles.append(tile.tobytes())
+
+    tiles_num = len(tiles)
+    entries_num = 9
+    ifd_offset = 8
+    offsets_offset = ifd_offset + 2 + entries_num * 12 + 4
+    counts_offset = offsets_offset + 4 * tiles_num
+    data_offset = counts_offset + 4 * tiles_num
+    offsets = [data_offset + i * len(tiles[0]) for i in range(tiles_num)]
+    entries = [(256, 3, 1, width), (257, 3, 1, height), (258, 3, 1, 16), (259, 3, 1, 1),
+               (277, 3, 1, 1), (322, 3, 1, tile_size), (323, 3, 1, tile_size),
+               (324, 4, tiles_num, offsets_offset), (325, 4, tiles_num, counts_offset)]
+    header = b'II' + struct.pack('<HI', 42, ifd_offset) + struct.pack('<H', entries_num)
+    for tag, tag_type, count, value in entries:
+        header += struct.pack('<HHI', tag, tag_type, count) + \
+                  (struct.pack('<HH', value, 0) if tag_type == 3 else struct.pack('<I', value))
+    header += struct.pack('<I', 0)
+    header += struct.pack(f'<{tiles_num}I', *offsets)
+    header += struct.pack(f'<{tiles_num}I', *[len(t) for t in tiles])
+    return header + b''.join(tiles)
+
+
+@pytest.fixture
+def image():
+    return np.arange(24 * 40, dtype=np.uint16).reshape(24, 40)
+
+
+@pytest.fixture
+def session(image):
+    return FakeSession(make_tiled_tiff(image, 16))
+
+
+def test_read_window(image, session):
+    reader = COGReader('http://test/image.tif', session=session)
+    assert (reader.width, reader.height, reader.tiles_across, reader.tiles_down) == (40, 24, 3, 2)
+    np.testing.assert_array_equal(reader.read_window(10, 5, 25, 19), image[5:24, 10:35])
+    np.testing.assert_array_equal(reader.read_window(0, 0, 40, 24), image)
+
+
+def test_requests_have_timeout(session):
+    reader = COGReader('http://test/image.tif', session=session)
+    reader.read_window(0, 0, 40, 24)
+    assert all(timeout == COGReader.timeout for timeout in session.timeouts)
+
+
+@pytest.mark.parametrize('window', [(30, 0, 16, 8),  # right edge is out of raster width
+                                    (0, 20, 8, 8),  # bottom edge is out of raster height
+                                    (40, 0, 1, 1),  # column out of raster, maps to tile of next row
+                                    (-1, 0, 4, 4),
+                                    (0, 0, 0, 4)])
+def test_read_window_out_of_raster(session, window):
+    reader = COGReader('http://test/image.tif', session=session)
+    with pytest.raises(Exception, match='out of raster'):
+        reader.read_window(*window)
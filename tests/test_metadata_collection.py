@@ -0,0 +1,54 @@
+import datetime
+import numpy as np
+import pytest
+from downloader.metadata_collection import MetadataCollection
+
+
+S2_ID = 'S2B_MSIL2A_20200501T065631_N0214_R063_T40UFB_2020050{}T090000'
+
+
+def write(path, text):
+    with open(path, 'w', newline='') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_read_csv_without_cloudcover_column(tmp_path):
+    # format of csv files written by query.py before cloudcover column was added
+    csv_file = write(tmp_path / 'old.csv',
+                     'platform,sceneid,productid,acqdate,tileid\r\n'
+                     f'Sentinel 2,{S2_ID.format(1)},a1,2020-05-01 06:56:31,T40UFB\r\n'
+                     f'Sentinel 2,{S2_ID.format(1)},a1,2020-05-01 06:56:31,T40UFB\r\n')
+    collection = MetadataCollection.read_csv(csv_file)
+    assert len(collection) == 2
+    assert np.isnan(collection['cloudcover']).all()
+    assert list(collection.rows())[0] == ('Sentinel 2', S2_ID.format(1), 'a1',
+                                          datetime.datetime(2020, 5, 1, 6, 56, 31), 'T40UFB', None)
+    # download_aws_l2a.py reads input csv this way
+    assert len(collection.dedup()) == 1
+
+
+@pytest.mark.parametrize('values', [['', ''], ['5', ''], ['', '12']])
+def test_read_csv_short_and_blank_cloudcover(tmp_path, values):
+    csv_file = write(tmp_path / 'short.csv',
+                     'platform,sceneid,productid,acqdate,tileid,cloudcover\r\n' +
+                     ''.join(f'Sentinel 2,{S2_ID.format(i)},a{i},2020-05-01 06:56:31,T40UFB,{v}\r\n'
+                             for i, v in enumerate(values)))
+    cloudcover = MetadataCollection.read_csv(csv_file)['cloudcover']
+    assert cloudcover.dtype == np.float32
+    np.testing.assert_array_equal(cloudcover, [float(v) if v else np.nan for v in values])
+
+
+def test_read_csv_blank_acqdate(tmp_path):
+    csv_file = write(tmp_path / 'blank_date.csv',
+                     'platform,sceneid,productid,acqdate,tileid,cloudcover\r\n'
+                     f'Sentinel 2,{S2_ID.format(1)},a1,,T40UFB,5\r\n')
+    assert np.isnat(MetadataCollection.read_csv(csv_file)['acqdate']).all()
+
+
+def test_write_read_csv(tmp_path):
+    collection = MetadataCollection.from_rows([
+        ('Sentinel 2', S2_ID.format(1), 'a1', datetime.datetime(2020, 5, 1, 6, 56, 31), 'T40UFB', 5.5),
+        ('Sentinel 2', S2_ID.format(2), 'a2', datetime.datetime(2020, 5, 2, 6, 56, 31), 'T40UFB', None)])
+    collection.write_csv(str(tmp_path / 'out.csv'))
+    assert list(MetadataCollection.read_csv(str(tmp_path / 'out.csv')).rows()) == list(collection.rows())
@@ -0,0 +1,98 @@
+import os
+import json
+from unittest import mock
+import pytest
+from downloader.scene_converter import AWS2SciHubConverter
+from downloader.scene_layout import SceneLayout
+
+
+SCENE = 'S2A_MSIL2A_20200501T065631_N0214_R063_T40UFB_20200501T100734'
+GRANULE = 'L2A_T40UFB_A025439_20200501T070655'
+
+
+def make_aws_scene(root, versions=('0', '1'), proper='1'):
+    """Scene folder in AWS layout (AWS_L2A.download_l2a_scene), file content is its source path."""
+    scene_path = os.path.join(root, SCENE)
+    os.makedirs(scene_path)
+    with open(os.path.join(scene_path, 'metadata.xml'), 'w') as f:
+        f.write(f'<x>GRANULE/{GRANULE}/IMG_DATA</x>')
+    with open(os.path.join(scene_path, 'productInfo.json'), 'w') as f:
+        f.write('{}')
+    for v in versions:
+        files = ['R10m/B02.jp2', 'R10m/B04.jp2', 'R20m/SCL.jp2', 'R60m/B01.jp2',
+                 'qi/MSK_CLOUDS_B00.gml', 'metadata.xml', 'tileInfo.json']
+        for name in files:
+            os.makedirs(os.path.dirname(os.path.join(scene_path, v, name)), exist_ok=True)
+            with open(os.path.join(scene_path, v, name), 'w') as f:
+                f.write(v + '/' + name)
+        with open(os.path.join(scene_path, v, 'productInfo.json'), 'w') as f:
+            json.dump({'name': SCENE if v == proper else 'other'}, f)
+    return scene_path
+
+
+def read_tree(path):
+    tree = dict()
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            with open(os.path.join(dirpath, name)) as f:
+                tree[os.path.relpath(os.path.join(dirpath, name), path)] = f.read()
+    return tree
+
+
+@pytest.fixture(autouse=True)
+def clear_layout_cache():
+    SceneLayout.clear()
+
+
+@pytest.fixture
+def converted(tmp_path):
+    scene_path = make_aws_scene(str(tmp_path / 'reference'))
+    assert AWS2SciHubConverter.convert_scene(scene_path) == 'converted'
+    return read_tree(scene_path)
+
+
+def test_convert_scene(converted):
+    assert converted['MTD_MSIL2A.xml'].startswith('<x>GRANULE')
+    assert converted[os.path.join('GRANULE', GRANULE, 'MTD_TL.xml')] == '1/metadata.xml'
+    assert converted[os.path.join('GRANULE', GRANULE, 'IMG_DATA', 'R10m', 'T40UFB_20200501T065631_B04_10m.jp2')] \
+        == '1/R10m/B04.jp2'
+    # productInfo.json of proper version replaces productInfo.json of scene
+    assert json.loads(converted['productInfo.json'])['name'] == SCENE
+    assert not any(name.startswith(('0' + os.sep, '1' + os.sep)) for name in converted)
+
+
+def test_replay_from_first_op_after_all_ops_applied(tmp_path, converted):
+    scene_path = make_aws_scene(str(tmp_path))
+    ops = AWS2SciHubConverter.plan(scene_path)
+    assert AWS2SciHubConverter.convert_scene(scene_path) == 'converted'
+    # progress marks are lost (e.g. OS crash), journal has only the plan
+    with open(os.path.join(scene_path, AWS2SciHubConverter.journal_name), 'w') as f:
+        f.write(json.dumps(ops) + '\n')
+    assert AWS2SciHubConverter.convert_scene(scene_path) == 'recovered'
+    assert read_tree(scene_path) == converted
+    assert AWS2SciHubConverter.convert_scene(scene_path) == 'skipped'
+
+
+def test_recovery_after_interruption_at_every_op(tmp_path, converted):
+    replace = os.replace
+    interrupted_at = 1
+    while True:
+        scene_path = make_aws_scene(str(tmp_path / str(interrupted_at)))
+        calls = [0]
+
+        def interrupting_replace(src, dst):
+            calls[0] += 1
+            if calls[0] == interrupted_at: raise OSError('interrupted')
+            replace(src, dst)
+
+        with mock.patch('os.replace', interrupting_replace):
+            try:
+                AWS2SciHubConverter.convert_scene(scene_path)
+                finished = True
+            except OSError:
+                finished = False
+        if finished: break
+        assert AWS2SciHubConverter.convert_scene(scene_path) == 'recovered'
+        assert read_tree(scene_path) == converted
+        interrupted_at += 1
+    assert interrupted_at > 1
@@ -0,0 +1,40 @@
+import datetime
+import numpy as np
+from downloader.scene_ids import S2SceneIDs, LandsatSceneIDs
+
+
+def test_parse_s2_ids():
+    ids = ['S2B_MSIL2A_20191109T081049_N0213_R078_T37TGK_20191109T101247',
+           'S2A_MSIL1C_20150704T101337_N0202_R022_T33UUP_20160606T205155.SAFE',
+           'S2B_MSIL2A_20191109T081049_N0213_R078_T37TGK_20191109T1012']
+    parsed = S2SceneIDs.parse(ids)
+    np.testing.assert_array_equal(parsed['valid'], [True, True, False])
+    np.testing.assert_array_equal(parsed['tile'][:2], [b'37TGK', b'33UUP'])
+    assert parsed['datetime'][0] == np.datetime64('2019-11-09T08:10:49')
+    assert parsed['baseline'][0] == 213 and parsed['orbit'][0] == 78
+    assert S2SceneIDs.get(ids[0]).version == datetime.datetime(2019, 11, 9, 10, 12, 47)
+
+
+def test_parse_landsat_ids():
+    ids = ['LC08_L2SP_166025_20161227_20200905_02_T2', 'LE07_L1TP_001025_20001231_20170101_01_RT']
+    parsed = LandsatSceneIDs.parse(ids)
+    assert parsed['valid'].all()
+    np.testing.assert_array_equal(parsed['path'], [166, 1])
+    np.testing.assert_array_equal(parsed['tier'], [b'T2', b'RT'])
+    assert parsed['date'][0] == np.datetime64('2016-12-27')
+    assert LandsatSceneIDs.get(ids[0]).pathrow == '166025'
+
+
+def test_parse_truncated_and_invalid_landsat_ids():
+    ids = ['LC08_L2SP_166025_20161227_20200905_02_T',
+           'LC08_L2SP_166025_20161227_20200905_02_',
+           'LC08_L2SP_166025_20161227_20200905_02_T3',
+           'LC08_L2SP_166025_20161227_20200905_02_T1_SR_B4',
+           '']
+    parsed = LandsatSceneIDs.parse(ids)
+    assert not parsed['valid'].any()
+    assert np.isnat(parsed['date']).all()
+    # bytes ids are checked the same way
+    np.testing.assert_array_equal(LandsatSceneIDs.parse(np.array(ids + ['LC08_L2SP_166025_20161227_20200905_02_T1'],
+                                                                 dtype='S'))['valid'],
+                                  [False] * len(ids) + [True])
@@ -0,0 +1,23 @@
+import os
+import json
+from downloader.scene_layout import SceneLayout
+
+
+SCENE = 'S2A_MSIL2A_20200501T065631_N0214_R063_T40UFB_20200501T100734'
+
+
+def test_missing_scene_folder(tmp_path):
+    assert SceneLayout.get(str(tmp_path / SCENE)) == {'granule': None, 'tile_version': 0}
+
+
+def test_tile_version_and_granule(tmp_path):
+    scene_path = tmp_path / SCENE
+    for version in ('0', '1'):
+        os.makedirs(scene_path / version)
+    with open(scene_path / '0' / 'productInfo.json', 'w') as f:
+        json.dump({'name': 'S2A_MSIL2A_20200501T065631_N0214_R063_T40UFB_20200501T090000'}, f)
+    layout = SceneLayout.get(str(scene_path))
+    assert (layout['granule'], layout['tile_version']) == (None, 1)
+
+    os.makedirs(scene_path / 'GRANULE' / 'L2A_T40UFB_A025404_20200501T070545')
+    assert SceneLayout.get(str(scene_path))['granule'] == 'L2A_T40UFB_A025404_20200501T070545'
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+from downloader.sr_reader import SRReader, SRTransform
+
+
+# S2 L2A before processing baseline 04.00: SR = raw / 10000
+TRANSFORM = SRTransform(scale=0.0001, clip_min=0, clip_max=1)
+
+
+@pytest.fixture
+def band_file(tmp_path):
+    raw = (np.arange(30 * 20, dtype=np.uint16) * 17 % 12000).reshape(30, 20)
+    path = str(tmp_path / 'B04.tif')
+    ds = gdal.GetDriverByName('GTiff').Create(path, 20, 30, 1, gdal.GDT_UInt16)
+    ds.GetRasterBand(1).WriteArray(raw)
+    ds = None
+    return path, raw
+
+
+@pytest.mark.parametrize('dtype', [np.int16, 'int16', np.dtype('int16')])
+def test_apply_int16(dtype):
+    sr = TRANSFORM.apply(np.array([0, 1234, 15000], dtype=np.float32), dtype)
+    assert sr.dtype == np.int16
+    np.testing.assert_array_equal(sr, [0, 1234, 10000])
+
+
+@pytest.mark.parametrize('dtype', [np.float32, 'float32'])
+def test_read_float32(band_file, dtype):
+    path, raw = band_file
+    sr = SRReader.read(path, TRANSFORM, dtype)
+    assert sr.dtype == np.float32
+    np.testing.assert_allclose(sr, np.clip(raw * 0.0001, 0, 1), atol=1e-6)
+
+
+@pytest.mark.parametrize('dtype', [np.int16, 'int16'])
+def test_read_int16(band_file, dtype):
+    path, raw = band_file
+    SRReader.block_rows = 8
+    try:
+        sr = SRReader.read(path, TRANSFORM, dtype, window=(2, 3, 15, 25))
+    finally:
+        SRReader.block_rows = 1024
+    assert sr.dtype == np.int16
+    np.testing.assert_array_equal(sr, np.minimum(raw[3:28, 2:17], 10000))
+
+
+def test_unsupported_dtype(band_file):
+    with pytest.raises(Exception, match='float32 or int16'):
+        SRReader.read(band_file[0], TRANSFORM, 'uint8')
@@ -0,0 +1,121 @@
+import math
+from osgeo import ogr
+from osgeo import osr
+
+
+class STRTree:
+    """
+    Static R-tree over envelopes (minx, miny, maxx, maxy) packed by Sort-Tile-Recursive algorithm.
+    Node is tuple (minx, miny, maxx, maxy, children), children is list of nodes
+    or index of envelope for leaf entries.
+    """
+
+    def __init__(self, envelopes, node_capacity=16):
+        self.node_capacity = node_capacity
+        nodes = [(env[0], env[1], env[2], env[3], i) for i, env in enumerate(envelopes)]
+        self.root = None
+        while len(nodes) > 0:
+            nodes = self.__pack(nodes)
+            if len(nodes) == 1:
+                self.root = nodes[0]
+                break
+
+    def __pack(self, entries):
+        # entries are sorted by x into vertical slices, every slice is sorted by y and cut into nodes
+        nodes_num = math.ceil(len(entries) / self.node_capacity)
+        slice_size = math.ceil(math.sqrt(nodes_num)) * self.node_capacity
+        entries = sorted(entries, key=lambda e: e[0] + e[2])
+        nodes = list()
+        for i in range(0, len(entries), slice_size):
+            vertical_slice = sorted(entries[i:i + slice_size], key=lambda e: e[1] + e[3])
+            for j in range(0, len(vertical_slice), self.node_capacity):
+                group = vertical_slice[j:j + self.node_capacity]
+                nodes.append((min(e[0] for e in group), min(e[1] for e in group),
+                              max(e[2] for e in group), max(e[3] for e in group), group))
+        return nodes
+
+    def query(self, minx, miny, maxx, maxy):
+        """Returns sorted indexes of envelopes intersecting query envelope."""
+        result = list()
+        stack = [self.root] if self.root is not None else list()
+        while len(stack) > 0:
+            node = stack.pop()
+            if node[0] > maxx or node[2] < minx or node[1] > maxy or node[3] < miny: continue
+            if isinstance(node[4], list):
+                stack.extend(node[4])
+            else:
+                result.append(node[4])
+        return sorted(result)
+
+
+class TileGrid:
+    """
+    Footprints of tile grid (Sentinel 2 MGRS tiles or Landsat WRS-2 path/rows) loaded from vector file,
+    e.g. converted ESA S2 tiling grid kml (id field "Name") or USGS WRS2_descending shapefile (id field "PR").
+    Grid files aren't included into the package.
+    Candidate tiles are selected by R-tree of envelopes, then tested by exact ogr Intersects,
+    so only tiles that really intersect AOI polygons are returned.
+    Integer ids are formatted as 6 digits (PR 170025 -> '170025', matches Landsat tileid of query.py).
+    """
+
+    def __init__(self, grid_file, id_field):
+        ds = ogr.Open(grid_file)
+        if ds is None:
+            raise Exception('ERROR: can\'t open grid file: ' + grid_file)
+        layer = ds.GetLayer(0)
+        if layer.GetLayerDefn().GetFieldIndex(id_field) < 0:
+            raise Exception('ERROR: field ' + id_field + ' not found in grid file: ' + grid_file)
+        transform = TileGrid.__get_transform(layer.GetSpatialRef())
+
+        self.ids = list()
+        # geometries are kept as WKB and created only for candidate tiles
+        self.geometries = list()
+        envelopes = list()
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None: continue
+            geometry = geometry.Clone()
+            if transform is not None: geometry.Transform(transform)
+            minx, maxx, miny, maxy = geometry.GetEnvelope()
+            envelopes.append((minx, miny, maxx, maxy))
+            self.geometries.append(geometry.ExportToWkb())
+            self.ids.append(TileGrid.__format_id(feature.GetField(id_field)))
+        self.index = STRTree(envelopes)
+
+    @staticmethod
+    def __format_id(value):
+        return str(value).zfill(6) if isinstance(value, int) else str(value)
+
+    @staticmethod
+    def __get_transform(srs):
+        """Returns transformation from srs to EPSG:4326 (lon/lat order), None if it isn't needed."""
+        wgs84 = osr.SpatialReference()
+        wgs84.ImportFromEPSG(4326)
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            if srs is not None: srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if srs is None or srs.IsSame(wgs84): return None
+        return osr.CoordinateTransformation(srs, wgs84)
+
+    def tiles_for_geometry(self, geometry):
+        """Returns ids of tiles intersecting ogr geometry in EPSG:4326."""
+        minx, maxx, miny, maxy = geometry.GetEnvelope()
+        return [self.ids[i] for i in self.index.query(minx, miny, maxx, maxy)
+                if geometry.Intersects(ogr.CreateGeometryFromWkb(self.geometries[i]))]
+
+    def tiles_for_vector_file(self, vector_file):
+        """Returns sorted ids of tiles intersecting any feature of vector file (all layers)."""
+        ds = ogr.Open(vector_file)
+        if ds is None:
+            raise Exception('ERROR: can\'t open vector file: ' + vector_file)
+        tiles = set()
+        for layer_index in range(ds.GetLayerCount()):
+            layer = ds.GetLayer(layer_index)
+            transform = TileGrid.__get_transform(layer.GetSpatialRef())
+            for feature in layer:
+                geometry = feature.GetGeometryRef()
+                if geometry is None: continue
+                geometry = geometry.Clone()
+                if transform is not None: geometry.Transform(transform)
+                tiles.update(self.tiles_for_geometry(geometry))
+        return sorted(tiles)